@@ -1,12 +1,46 @@
+from django.conf import settings
 from django.db import transaction
 from django.db.utils import IntegrityError
 from django.utils.dateparse import parse_datetime
-from .helpers import check_for_reorg, get_missing_heights_repr, get_prefetched_header_and_block_data
-from .models import Block, BlockHeader, Output, Kernel, Input
+from redis.exceptions import LockNotOwnedError
+from .chain_index import ChainIndex
+from .helpers import (
+    check_for_reorg,
+    enqueue_accepted_heights,
+    get_missing_heights_repr,
+    get_ingestion_lock,
+    get_prefetched_header_and_block_data,
+    has_accepted_heights,
+    load_blockchain_snapshot,
+    pop_accepted_heights,
+    prefetch_blocks,
+    queue_blocks_broadcast,
+    release_ingestion_lock,
+    store_blockchain_snapshot,
+)
+from .models import (
+    Block,
+    Blockchain,
+    BlockHeader,
+    Output,
+    Kernel,
+    Input,
+    Reorg,
+    SearchEntry,
+    UnspentOutput,
+)
 from .node import NodeV2API, NodeBlockNotFoundException
+from .serializers import BlockSerializer
 from .exceptions import UpdateBlockchainProgressError
+from .stats import (
+    add_block_to_stats,
+    get_kernel_stats,
+    get_nr_main_blocks,
+    update_block_difficulty_stats,
+)
 
 import decimal
+import json
 import math
 import logging
 
@@ -93,6 +127,7 @@ def fetch_and_store_block(blockchain, block_height, prefetch=True):
                 nr_inputs=len(block_data['inputs']),
                 nr_outputs=len(block_data['outputs']),
                 nr_kernels=len(block_data['kernels']),
+                **get_kernel_stats(block_data['kernels']),
             )
         except IntegrityError as e:
             # race condition so it's a duplicate. We can skip creation process
@@ -141,7 +176,16 @@ def fetch_and_store_block(blockchain, block_height, prefetch=True):
         Input.objects.bulk_create(inputs)
         # mark the corresponding outputs as spent, but only on the main chain so
         # that we don't corrupt the reorged data
-        Output.objects.filter(pk__in=outputs_mapper.values()).update(spent=True)
+        Output.objects\
+            .filter(pk__in=outputs_mapper.values())\
+            .update(
+                spent=True,
+                spent_in_block=block,
+                spent_height=block.height,
+            )
+        UnspentOutput.objects\
+            .filter(output_id__in=outputs_mapper.values())\
+            .delete()
 
         # create output instances
         outputs = []
@@ -150,15 +194,21 @@ def fetch_and_store_block(blockchain, block_height, prefetch=True):
                 commitment__in=list(map(lambda x: x['commit'], block_data['outputs'])),
                 block__reorg__isnull=True,
                 block__blockchain=block.blockchain,
-            )
+            )\
+            .select_related('block')
         inputs_mapper = { input.commitment : input for input in inputs }
         for output_data in block_data['outputs']:
+            # the spending block might already be stored since bootstrap goes
+            # from the highest height down
+            spending_input = inputs_mapper.get(output_data['commit'])
             outputs.append(
                 Output(
                     block=block,
                     output_type=output_data['output_type'],
                     commitment=output_data['commit'],
                     spent=output_data['spent'],
+                    spent_in_block=spending_input.block if spending_input else None,
+                    spent_height=spending_input.block.height if spending_input else None,
                     proof=output_data['proof'],
                     proof_hash=output_data['proof_hash'],
                     merkle_proof=output_data['merkle_proof'],
@@ -175,9 +225,257 @@ def fetch_and_store_block(blockchain, block_height, prefetch=True):
                 matching_input.output = output
                 fixed_inputs.append(matching_input)
         Input.objects.bulk_update(fixed_inputs, ['output'])
+        # add outputs to the UTXO set, conflicts can only come from blocks which
+        # are not yet known to be reorged and they're fixed with the reorg
+        UnspentOutput.objects.bulk_create(
+            [
+                UnspentOutput(
+                    blockchain=blockchain,
+                    commitment=output.commitment,
+                    output=output,
+                )
+                for output in outputs
+                if not output.spent
+            ],
+            ignore_conflicts=True,
+        )
+
+        # add block, its kernels and outputs to the search index
+        search_entries = [
+            SearchEntry(
+                blockchain=blockchain,
+                term=block.hash,
+                type=SearchEntry.Type.BLOCK,
+                block=block,
+                height=block.height,
+            )
+        ]
+        search_entries += [
+            SearchEntry(
+                blockchain=blockchain,
+                term=kernel.excess,
+                type=SearchEntry.Type.KERNEL,
+                block=block,
+                height=block.height,
+            )
+            for kernel in kernels
+        ]
+        search_entries += [
+            SearchEntry(
+                blockchain=blockchain,
+                term=output.commitment,
+                type=SearchEntry.Type.OUTPUT,
+                block=block,
+                height=block.height,
+            )
+            for output in outputs
+        ]
+        SearchEntry.objects.bulk_create(search_entries)
+
+        # new blocks are always stored on the main chain
+        add_block_to_stats(block)
+        # the next block might already be stored since bootstrap goes from the
+        # highest height down
+        update_block_difficulty_stats(
+            blockchain, block.height, block.height + 1)
     return block
 
 
+def get_or_fetch_block(blockchain, block_height, hash=None, prefetch=True):
+    """
+    Returns the node's main chain block at the given height. Its hash is
+    compared with our stored blocks first (it's read from the node's header
+    when not given) and the full block is only fetched when we don't have it.
+    """
+    if hash is None:
+        hash = NodeV2API(blockchain.node).get_header(height=block_height)['hash']
+    block = blockchain.blocks.filter(hash=hash).first()
+    if block:
+        return block
+    return fetch_and_store_block(blockchain, block_height, prefetch=prefetch)
+
+
+def store_accepted_block(blockchain, height, prefetch=False):
+    """
+    Stores the node's block at the given height, which was reported by the
+    node as accepted, and handles a reorg if it replaced our block at that
+    height. Returns tuple (block, reorged) or None if we already had it.
+    """
+    reorged = False
+    with transaction.atomic():
+        # handle reorg case
+        # we expect blocks to come ordered by height, there are some edge cases
+        # here which are not handled, but they're unlikely to happen (eg. reorg
+        # happens but websocket calls for first blocks fails while for later it
+        # doesn't and then the code bellow wouldn't spot a reorg)
+        block_at_this_height = blockchain.blocks\
+            .filter(height=height, reorg__isnull=True)\
+            .first()
+        # we fetch here because anyone can call this view - we don't want to
+        # work with fake data
+        if block_at_this_height:
+            # compare the node's header first, we only need the full block
+            # if it's not the one we have
+            new_block = get_or_fetch_block(
+                blockchain, height, prefetch=prefetch)
+        else:
+            new_block = fetch_and_store_block(
+                blockchain, height, prefetch=prefetch)
+        if block_at_this_height:
+            if block_at_this_height.hash == new_block.hash:
+                # probably have fetched this block while bootstraping, accepted
+                # view got called a bit later so we already have it, noop
+                return None
+            logger.info(
+                'Block accepted - reorg spotted',
+                extra={
+                    'block_at_this_height': block_at_this_height,
+                    'block_at_this_height.hash': block_at_this_height.hash,
+                    'block_at_this_height.reorg': block_at_this_height.reorg,
+                    'hash': new_block.hash
+                },
+            )
+            # reorg spotted
+            reorged_blocks = list(blockchain.blocks\
+                .filter(height__gte=height, reorg__isnull=True)
+                .exclude(pk=new_block.pk)
+                .order_by('height'))
+            logger.info('reorged_blocks at start: {}'.format(reorged_blocks))
+            # these reorged blocks are guaranteed to be reorged, now find any
+            # previous blocks which were also reorged - aka get common
+            # ancestor of the reorged block at 'height' and the new (main) block
+
+            # find the common ancestor of this block and the reorged block at
+            # the same height. We start with the current height to avoid more
+            # logic for Reorg instance params
+            if new_block.hash == block_at_this_height.hash:
+                # at height X we got H1, then we got H2 (this call), but now it
+                # reorged back to H1, so we don't do anything, no reorg is
+                # stored since we didn't fetch the block in time from the node
+                logger.info('Reorg cancelled out, noop')
+                return None
+            logger.info('new_block', extra={'hash': new_block.hash, 'prev_hash': new_block.prev_hash})
+            prev_block_new_chain = new_block
+            prev_block_old_chain = reorged_blocks[0]
+            logger.info('prev_block_new_chain: {}, prev_block_old_chain: {}'.format(prev_block_new_chain, prev_block_old_chain))
+            # remove the first one since it will get added again
+            reorged_blocks = reorged_blocks[1:]
+            logger.info('reorged_blocks after [1:]: {}'.format(reorged_blocks))
+            main_blocks = []
+            while True:
+                # theoretically we might be missing the block in db but we don't
+                # cover such cases currently
+                if not prev_block_new_chain:
+                    logger.info('reached break in IF NOT prev_block_new_chain')
+                    # this means that prev_block_old_chain is also None, since
+                    # they're both "previous" of their genesis block
+                    break
+                if prev_block_new_chain == prev_block_old_chain:
+                    logger.info('reached break in IF NOT prev_block_new_chain == prev_block_old_chain')
+                    # found the common ancestor
+                    break
+                # add to the left because we want to keep it sorted by height
+                reorged_blocks.insert(0, prev_block_old_chain)
+                main_blocks.insert(0, prev_block_new_chain)
+                logger.info('new reorged_blocks: {}'.format(reorged_blocks))
+                logger.info('new main_blocks: {}'.format(main_blocks))
+                prev_block_new_chain = prev_block_new_chain.get_previous_block()
+                prev_block_old_chain = prev_block_old_chain.get_previous_block()
+                logger.info('new prev_block_new_chain: {}, prev_block_old_chain: {}'.format(prev_block_new_chain, prev_block_old_chain))
+
+            logger.info('before reorg create: reorged_blocks: {}, main_blocks: {}'.format(reorged_blocks, main_blocks))
+            reorg = Reorg.objects.create(
+                blockchain=blockchain,
+                start_reorg_block=reorged_blocks[0],
+                end_reorg_block=reorged_blocks[-1],
+                start_main_block=main_blocks[0],
+            )
+            # Reorg post_save signal fixes .reorg on new/old blocks and fixes
+            # inputs/outputs
+            reorged = True
+    return new_block, reorged
+
+
+def store_accepted_blocks(blockchain, heights, renew_lock_fn=None):
+    """
+    Stores the node's blocks at the given ascending heights, which were
+    reported by the node as accepted, and notifies the clients once. When
+    there's more than one height (eg. the node is catching up) the blocks are
+    fetched in ranges of consecutive heights. renew_lock_fn, if given, is
+    called before each block to renew the caller's ingestion lock. If a block
+    fails to be stored, its height and the following ones are queued again
+    and the exception is re-raised. Returns tuple (stored blocks, reorged).
+    """
+    new_blocks = []
+    reorged = False
+    # index of the height which is being stored
+    i = 0
+    try:
+        if len(heights) > 1:
+            prefetch_blocks(blockchain.node, heights)
+        for i, height in enumerate(heights):
+            if renew_lock_fn:
+                renew_lock_fn()
+            res = store_accepted_block(
+                blockchain, height, prefetch=len(heights) > 1)
+            if res:
+                new_blocks.append(res[0])
+                reorged = reorged or res[1]
+    except Exception:
+        logger.exception(
+            'Failed to store accepted block',
+            extra={'blockchain': blockchain.slug, 'height': heights[i]},
+        )
+        # the heights were already taken from the queue, storing the later
+        # ones without this one would leave a gap which reorg checks don't
+        # expect
+        enqueue_accepted_heights(blockchain.slug, heights[i:])
+        raise
+    finally:
+        if new_blocks:
+            _notify_accepted_blocks(blockchain, new_blocks, reorged)
+    return new_blocks, reorged
+
+
+def _notify_accepted_blocks(blockchain, new_blocks, reorged):
+    # clients are notified with the next coalesced broadcast and they only
+    # show the latest blocks
+    queue_blocks_broadcast(
+        blockchain.slug,
+        BlockSerializer(
+            new_blocks[-settings.WS_NEW_BLOCKS_LIMIT:], many=True).data,
+        len(new_blocks),
+        reorged,
+    )
+    # update the loading progress since it could be skewed due to the
+    # periodic task updating it before these blocks were stored
+    try:
+        update_blockchain_progress(blockchain)
+    except UpdateBlockchainProgressError:
+        # ignore it, let it update itself the next time
+        pass
+
+
+def store_queued_accepted_blocks(blockchain, lock):
+    """
+    Stores all queued accepted blocks of the blockchain in batches. The caller
+    must hold the blockchain's ingestion lock, which is renewed for each
+    block. Returns tuple (stored blocks, reorged).
+    """
+    new_blocks = []
+    reorged = False
+    heights = pop_accepted_heights(
+        blockchain.slug, settings.ACCEPTED_BLOCKS_BATCH_SIZE)
+    while heights:
+        batch_blocks, batch_reorged = store_accepted_blocks(
+            blockchain, heights, renew_lock_fn=lock.reacquire)
+        new_blocks += batch_blocks
+        reorged = reorged or batch_reorged
+        heights = pop_accepted_heights(
+            blockchain.slug, settings.ACCEPTED_BLOCKS_BATCH_SIZE)
+    return new_blocks, reorged
+
+
 def load_blocks(
     blockchain, start_height, end_height, skip_reorg_check, verbose=False
 ):
@@ -190,6 +488,46 @@ def load_blocks(
             'skip_reorg_check': skip_reorg_check,
         },
     )
+    # only one writer stores blocks of this blockchain at a time
+    lock = get_ingestion_lock(blockchain.slug)
+    lock.acquire()
+    try:
+        end_height = _load_missing_blocks(
+            blockchain, start_height, end_height, skip_reorg_check, lock)
+    except LockNotOwnedError:
+        # the lock expired and another writer took it, loading must not race
+        # with it so the missing blocks are left to the next bootstrap
+        logger.warning(
+            'Ingestion lock lost, loading blocks aborted',
+            extra={'blockchain': blockchain.slug},
+        )
+        return
+    finally:
+        # accepted blocks which were queued meanwhile are stored by the
+        # ingestion task
+        release_ingestion_lock(lock)
+        if has_accepted_heights(blockchain.slug):
+            # import here to avoid cyclic import
+            from .tasks import ingest_accepted_blocks
+            ingest_accepted_blocks.send(blockchain.slug)
+    logger.info(
+        'Loading blocks finished',
+        extra={
+            'blockchain': blockchain.slug,
+            'start_height': start_height,
+            'end_height': end_height,
+            'skip_reorg_check': skip_reorg_check,
+        },
+    )
+
+
+def _load_missing_blocks(
+    blockchain, start_height, end_height, skip_reorg_check, lock
+):
+    """
+    Fetches missing main chain blocks by descending height while holding the
+    blockchain's ingestion lock. Returns the height of the last loaded block.
+    """
     existing_heights = set(list(
         blockchain.blocks\
             .filter(reorg__isnull=True)\
@@ -211,13 +549,27 @@ def load_blocks(
     # each block
     nr_checked_missing_heights = 0
     nr_missing_heights = len(missing_heights)
-    skip_reorg_check = False
+    chain_index = None
+    if not skip_reorg_check:
+        # reorg checks only compare hashes, so they're done in memory over
+        # the whole range, they also look at the blocks right outside of it
+        chain_index = ChainIndex.load(
+            blockchain, max(start_height - 1, 0), end_height + 1)
     for block_height in sorted(missing_heights, reverse=True):
         if block_height in checked_heights:
             continue
-        if not skip_reorg_check and nr_checked_missing_heights > 1000:
-            # we don't want to keep checking for reorgs forever since it's slow
-            skip_reorg_check = True
+        lock.reacquire()
+        if has_accepted_heights(blockchain.slug):
+            # live blocks are handed priority over bootstrap, they're stored
+            # here since this process holds the lock
+            new_blocks, reorged = store_queued_accepted_blocks(blockchain, lock)
+            if reorged and chain_index:
+                chain_index = ChainIndex.load(
+                    blockchain, max(start_height - 1, 0), end_height + 1)
+            elif chain_index:
+                for new_block in new_blocks:
+                    chain_index.set(
+                        new_block.height, new_block.hash, new_block.prev_hash)
         update_load_progress(
             blockchain, 
             # len(missing_heights - checked_heights),
@@ -254,8 +606,9 @@ def load_blocks(
                     verbose=True,
                     source='check_for_reorg',
                 ),
+                lock.reacquire,
                 missing_heights,
-                start_height
+                chain_index,
             )
             checked_heights |= fetched_heights
             nr_checked_missing_heights = len(checked_heights & missing_heights)
@@ -269,15 +622,7 @@ def load_blocks(
         decimal_places,
         verbose=True
     )
-    logger.info(
-        'Loading blocks finished',
-        extra={
-            'blockchain': blockchain.slug,
-            'start_height': start_height,
-            'end_height': end_height,
-            'skip_reorg_check': skip_reorg_check,
-        },
-    )
+    return end_height
 
 
 def update_blockchain_progress(blockchain):
@@ -306,3 +651,40 @@ def update_blockchain_progress(blockchain):
         verbose=True
     )
 
+
+def render_blockchain_snapshot(blockchain):
+    """
+    Renders the message with the blockchain's latest main chain blocks, tip
+    and load progress which clients get when they subscribe to it and stores
+    it in redis. Returns the message's text.
+    """
+    main_blocks = blockchain.blocks.filter(reorg=None)
+    blocks = list(
+        main_blocks.order_by('-height')[:settings.WS_SNAPSHOT_NR_BLOCKS])
+    text = json.dumps({
+        'type': 'snapshot',
+        'message': {
+            'blockchain': blockchain.slug,
+            'load_progress': float(blockchain.load_progress),
+            'height': blocks[0].height if blocks else None,
+            'nr_blocks': get_nr_main_blocks(blockchain),
+            'blocks': BlockSerializer(blocks, many=True).data,
+        },
+    })
+    store_blockchain_snapshot(blockchain.slug, text)
+    return text
+
+
+def get_blockchain_snapshot(blockchain_slug):
+    """
+    Returns the blockchain's pre-rendered snapshot message, it's rendered if
+    it's not in redis yet. Returns None if the blockchain doesn't exist.
+    """
+    text = load_blockchain_snapshot(blockchain_slug)
+    if text is not None:
+        return text
+    try:
+        blockchain = Blockchain.objects.get(slug=blockchain_slug)
+    except Blockchain.DoesNotExist:
+        return
+    return render_blockchain_snapshot(blockchain)
@@ -0,0 +1,81 @@
+HASH_SIZE = 32
+
+
+class ChainIndex:
+    """
+    Compact in-memory index of main chain blocks, it maps a height to the
+    block's (hash, prev_hash). Hashes are kept as raw bytes in bytearrays
+    where the slot of a height starts at (height - start_height) * HASH_SIZE
+    and their lengths are kept in separate bytearrays (0 means there's no
+    block or no previous hash), so it takes 66 bytes per height.
+    """
+
+    def __init__(self, start_height, end_height):
+        self.start_height = start_height
+        size = max(end_height - start_height + 1, 0)
+        self.hashes = bytearray(size * HASH_SIZE)
+        self.prev_hashes = bytearray(size * HASH_SIZE)
+        self.hash_lengths = bytearray(size)
+        self.prev_hash_lengths = bytearray(size)
+
+    @classmethod
+    def load(cls, blockchain, start_height, end_height):
+        """
+        Returns an index of the main chain blocks with heights in the given
+        range, they're read with one streaming query.
+        """
+        index = cls(start_height, end_height)
+        blocks = blockchain.blocks\
+            .filter(
+                reorg__isnull=True,
+                height__gte=start_height,
+                height__lte=end_height,
+            )\
+            .order_by('height')\
+            .values_list('height', 'hash', 'prev_hash')\
+            .iterator(chunk_size=10000)
+        for height, hash, prev_hash in blocks:
+            index.set(height, hash, prev_hash)
+        return index
+
+    def _grow(self, height):
+        if height < self.start_height:
+            size = self.start_height - height
+            self.hashes[0:0] = bytearray(size * HASH_SIZE)
+            self.prev_hashes[0:0] = bytearray(size * HASH_SIZE)
+            self.hash_lengths[0:0] = bytearray(size)
+            self.prev_hash_lengths[0:0] = bytearray(size)
+            self.start_height = height
+        size = height - self.start_height + 1 - len(self.hash_lengths)
+        if size > 0:
+            self.hashes.extend(bytearray(size * HASH_SIZE))
+            self.prev_hashes.extend(bytearray(size * HASH_SIZE))
+            self.hash_lengths.extend(bytearray(size))
+            self.prev_hash_lengths.extend(bytearray(size))
+
+    def set(self, height, hash, prev_hash):
+        self._grow(height)
+        pos = height - self.start_height
+        offset = pos * HASH_SIZE
+        hash = bytes.fromhex(hash)
+        prev_hash = bytes.fromhex(prev_hash) if prev_hash else b''
+        self.hashes[offset:offset + len(hash)] = hash
+        self.prev_hashes[offset:offset + len(prev_hash)] = prev_hash
+        self.hash_lengths[pos] = len(hash)
+        self.prev_hash_lengths[pos] = len(prev_hash)
+
+    def get(self, height):
+        """
+        Returns (hash, prev_hash) of the main chain block at the given height
+        or None if it's not in the index.
+        """
+        pos = height - self.start_height
+        if pos < 0 or pos >= len(self.hash_lengths):
+            return None
+        if not self.hash_lengths[pos]:
+            return None
+        offset = pos * HASH_SIZE
+        hash = self.hashes[offset:offset + self.hash_lengths[pos]]
+        prev_hash = self.prev_hashes[
+            offset:offset + self.prev_hash_lengths[pos]]
+        return hash.hex(), prev_hash.hex() or None
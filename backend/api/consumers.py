@@ -1,7 +1,8 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
 from django.conf import settings
-from .helpers import load_data_from_redis
+from .bootstrap import get_blockchain_snapshot
+from .helpers import get_blockchain_group_name, load_data_from_redis
 
 import json
 import logging
@@ -10,87 +11,69 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-class RegularConsumer(WebsocketConsumer):
-    def connect(self):
-        async_to_sync(self.channel_layer.group_add)(
-            'default_group',
-            self.channel_name,
-        )
-        self.accept()
-        self.send(text_data=json.dumps({
-            'type': 'price_update',
-            'message': load_data_from_redis(settings.REDIS_PRICE_KEY),
-        }))
+class ForwardingConsumer(AsyncWebsocketConsumer):
+    """
+    Consumer which forwards group messages sent with send_websocket_message,
+    they're serialized once by the sender instead of once per connection.
+    """
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
-            'default_group',
-            self.channel_name
-        )
-        super().disconnect(close_code)
+    async def forward(self, event):
+        await self.send(text_data=event['text'])
 
-    def send_block(self, event):
-        block_data = event['message']
-        self.send(text_data=json.dumps({
-            'type': 'new_block',
-            'message': block_data,
-        }))
 
-    def reorged(self, event):
-        blockchain_slug = event['message']
-        self.send(text_data=json.dumps({
-            'type': 'reorged',
-            'message': blockchain_slug,
-        }))
-
-    def price_update(self, event):
-        price_data = event['message']
-        self.send(text_data=json.dumps({
+class RegularConsumer(ForwardingConsumer):
+    async def connect(self):
+        # group of the blockchain whose blocks the client is shown
+        self.blockchain_group = None
+        await self.channel_layer.group_add('default_group', self.channel_name)
+        await self.accept()
+        price_data = await sync_to_async(load_data_from_redis)(
+            settings.REDIS_PRICE_KEY)
+        await self.send(text_data=json.dumps({
             'type': 'price_update',
             'message': price_data,
         }))
 
-
-class AdminConsumer(WebsocketConsumer):
-    def connect(self):
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(
+            'default_group', self.channel_name)
+        if self.blockchain_group:
+            await self.channel_layer.group_discard(
+                self.blockchain_group, self.channel_name)
+        await super().disconnect(close_code)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get('type') != 'subscribe':
+            return
+        group = get_blockchain_group_name(data.get('blockchain'))
+        if group is None or group == self.blockchain_group:
+            return
+        # clients only follow one blockchain at a time
+        if self.blockchain_group:
+            await self.channel_layer.group_discard(
+                self.blockchain_group, self.channel_name)
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.blockchain_group = group
+        # the client gets the current state right away instead of asking
+        # for it through the api
+        snapshot = await sync_to_async(get_blockchain_snapshot)(
+            data['blockchain'])
+        if snapshot is not None:
+            await self.send(text_data=snapshot)
+
+
+class AdminConsumer(ForwardingConsumer):
+    async def connect(self):
         logger.debug('WebSocketConsumer CONNECTED', extra={'channel_name': self.channel_name})
-        async_to_sync(self.channel_layer.group_add)(
-            'admin_group',
-            self.channel_name,
-        )
-        self.accept()
+        await self.channel_layer.group_add('admin_group', self.channel_name)
+        await self.accept()
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
         logger.debug('WebSocketConsumer DISCONNECTED', extra={'channel_name': self.channel_name})
-        async_to_sync(self.channel_layer.group_discard)(
-            'admin_group',
-            self.channel_name
-        )
-        super().disconnect(close_code)
-
-    def blockchain_progress_changed(self, event):
-        logger.debug(
-            'WebSocketConsumer PROGRESS_CHANGED',
-            extra={
-                'blockchain': event['message']['slug'],
-                'load_progress': event['message']['load_progress'],
-                'channel': self.channel_name,
-            },
-        )
-        self.send(text_data=json.dumps({
-            'type': 'blockchain_progress_changed',
-            'message': event['message'],
-        }))
-
-    def task_status_changed(self, event):
-        self.send(text_data=json.dumps({
-            'type': 'task_status_changed',
-            'message': event['message'],
-        }))
-
-    def blockchain_deleted(self, event):
-        self.send(text_data=json.dumps({
-            'type': 'blockchain_deleted',
-            'message': event['message'],
-        }))
-
+        await self.channel_layer.group_discard(
+            'admin_group', self.channel_name)
+        await super().disconnect(close_code)
@@ -1,9 +1,16 @@
 from django.conf import settings
-from django.db.models import Count, F
+from django.db.models import F
 from django_filters import rest_framework as filters
 from rest_framework import filters as DRFfilters
 from rest_framework.exceptions import APIException
-from .models import Blockchain, Block, Node, NodeGroup, Reorg, Kernel, Output
+from .models import (
+    Blockchain,
+    Block,
+    Node,
+    NodeGroup,
+    Reorg,
+    SearchEntry,
+)
 
 import logging
 
@@ -33,6 +40,8 @@ class CustomBlockSearchFilter(DRFfilters.SearchFilter):
     """
     Alongside the given search_fields this filter filters also by:
     -  keyword 'reorgs' --> return only blocks where reorgs happened
+    -  block hash, kernel excess, output commitment or a prefix of any of them
+       --> return blocks which include them, main chain blocks first
     -  ['inputs', 'outputs', 'kernels'] ['=', '<', '>', '<=', '>='] [value] -->
        return only blocks matching this computation, eg: 'inputs > 2'
     You cannot combine different types of search (eg. 'reorgs' + 'computation')
@@ -71,12 +80,13 @@ class CustomBlockSearchFilter(DRFfilters.SearchFilter):
         elif searched_types == { 'computation' }:
             return self._get_computations_qs(search_terms, blockchain_slug)
         elif searched_types == { 'hash' }:
-            return self._get_hash_qs(search_terms[0]['value'], blockchain_slug, queryset)
+            return self._get_search_entry_qs(
+                search_terms[0]['value'], blockchain_slug)
         elif searched_types == { 'height' }:
             return self._get_height_qs(search_terms[0]['value'], blockchain_slug)
-        elif searched_types == { 'kernel_or_output' }:
-            return self._get_kernel_or_output_qs(
-                search_terms[0]['value'], blockchain_slug)
+        elif searched_types == { 'prefix' }:
+            return self._get_search_entry_qs(
+                search_terms[0]['value'], blockchain_slug, prefix=True)
         else:
             logger.exception(
                 'Invalid search terms',
@@ -112,49 +122,47 @@ class CustomBlockSearchFilter(DRFfilters.SearchFilter):
             elif isinstance(search_terms[i], str) and search_terms[i].lower() == 'reorgs':
                 normalized_terms.append({ 'type': 'reorgs' })
                 i += 1
-            elif len(search_terms[i]) == 64:
-                # hash
+            elif self._is_hex(search_terms[i]) and len(search_terms[i]) in [64, 66]:
+                # block hash, kernel excess or output commitment
                 normalized_terms.append({
                     'type': 'hash',
-                    'value': search_terms[i],
+                    'value': search_terms[i].lower(),
+                })
+                i += 1
+            elif search_terms[i].isdigit():
+                normalized_terms.append({
+                    'type': 'height',
+                    'value': int(search_terms[i]),
                 })
                 i += 1
-            elif len(search_terms[i]) == 66:
-                # kernel excess or output commitment
+            elif (
+                self._is_hex(search_terms[i]) and
+                len(search_terms[i]) >= settings.MIN_SEARCH_PREFIX_LEN
+            ):
+                # prefix of block hash, kernel excess or output commitment
                 normalized_terms.append({
-                    'type': 'kernel_or_output',
-                    'value': search_terms[i],
+                    'type': 'prefix',
+                    'value': search_terms[i].lower(),
                 })
                 i += 1
             else:
-                try:
-                    value = int(search_terms[i])
-                except ValueError:
-                    value = None
-                if value >= 0:
-                    normalized_terms.append({
-                        'type': 'height',
-                        'value': value,
-                    })
-                    i += 1
-                else:
-                    # term which is not for this custom search, eg. block hash
-                    i += 1
+                # term which is not for this custom search
+                i += 1
         return normalized_terms
 
+    def _is_hex(self, term):
+        return all(c in '0123456789abcdef' for c in term.lower())
+
     def _get_reorgs_qs(self, blockchain_slug):
-        # NOTE: we first filter, then calculate reorg_len on filtered data and
-        # then filter on annotated data that we've calculated
-        reorg_heights = list(Reorg.objects\
-            .select_related('start_main_block')\
+        # reorg_len and start_main_height are stored on Reorg, so this is a
+        # single query which uses reorg_len_start_main_idx index
+        reorg_heights = Reorg.objects\
             .filter(
                 blockchain__slug=blockchain_slug,
+                reorg_len__gte=settings.MIN_REORG_LEN,
                 start_main_block__reorg=None,
             )\
-            .annotate(reorg_len=F('end_reorg_block__height') - F('start_reorg_block__height') + 1)\
-            .filter(reorg_len__gte=settings.MIN_REORG_LEN)\
-            .values_list('start_main_block__height', flat=True)
-        )
+            .values('start_main_height')
         queryset = Block.objects\
             .filter(
                 blockchain__slug=blockchain_slug,
@@ -164,32 +172,23 @@ class CustomBlockSearchFilter(DRFfilters.SearchFilter):
             .order_by('-height')
         return queryset
 
-    def _get_hash_qs(self, hash, blockchain_slug, queryset):
-        return queryset.filter(
-            blockchain__slug=blockchain_slug,
-            hash=hash,
-        )
-
     def _get_height_qs(self, height, blockchain_slug):
         return Block.objects.filter(
             blockchain__slug=blockchain_slug,
             height=height,
         )
 
-    def _get_kernel_or_output_qs(self, kernel_or_output, blockchain_slug):
-        kernel = Kernel.objects.filter(
-            excess=kernel_or_output,
-            block__blockchain__slug=blockchain_slug,
-        ).first()
-        if kernel:
-            return Block.objects.filter(hash=kernel.block.hash)
-        output = Output.objects.filter(
-            commitment=kernel_or_output,
-            block__blockchain__slug=blockchain_slug,
-        ).first()
-        if output:
-            return Block.objects.filter(hash=output.block.hash)
-        return Block.objects.none()
+    def _get_search_entry_qs(self, term, blockchain_slug, prefix=False):
+        # a single probe of the search index, blocks on the main chain first
+        search_entries = SearchEntry.objects.filter(
+            blockchain__slug=blockchain_slug)
+        if prefix:
+            search_entries = search_entries.filter(term__startswith=term)
+        else:
+            search_entries = search_entries.filter(term=term)
+        return Block.objects\
+            .filter(hash__in=search_entries.values('block_id'))\
+            .order_by(F('reorg').asc(nulls_first=True), '-height')
 
     def _get_computations_qs(self, search_terms, blockchain_slug):
         operator_mapping = {
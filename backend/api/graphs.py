@@ -1,46 +1,126 @@
 from datetime import datetime, timedelta
-from itertools import groupby
-from django.db.models import Count
-from backend.api.models import Block
+from django.conf import settings
+from backend.api.models import StatsBucket
+from backend.api.stats import get_supply
 
 import pytz
 
 
-def get_transaction_graph_data(blockchain_slug):
+TIMESERIES_METRICS = [
+    'blocks',
+    'transactions',
+    'kernels',
+    'inputs',
+    'outputs',
+    'fees',
+    'average_fee',
+    'block_interval',
+    'difficulty',
+    'hashrate',
+    'kernel_features',
+    'supply',
+    'emission',
+]
+
+
+def get_transaction_graph_data(blockchain_slug, days=7):
     # set time to zero so that you get blocks for full 'first' day
     today = datetime.utcnow()\
         .replace(hour=0, minute=0, second=0, microsecond=0)\
         .astimezone(pytz.utc)
-    last_week = today - timedelta(days=7)
-    res = list(Block.objects\
+    start = today - timedelta(days=days)
+    # daily stats are precomputed when blocks are stored
+    daily_stats = StatsBucket.objects\
         .filter(
             blockchain__slug=blockchain_slug,
-            reorg=None,
-            timestamp__gte=last_week,
-        )\
-        .prefetch_related('kernels', 'inputs', 'outputs')\
-        .annotate(
-            kernels_count=Count('kernels', distinct=True),
-            inputs_count=Count('inputs', distinct=True),
-            outputs_count=Count('outputs', distinct=True),
+            resolution=StatsBucket.Resolution.DAY,
+            start__gte=start,
         )\
-        .order_by('timestamp')\
-        .values('pk', 'timestamp', 'kernels_count', 'inputs_count', 'outputs_count'))
-    tx_graph_data = []
-    # group by day
-    res = sorted(res, key=lambda x: x['timestamp'].date(), reverse=True)
-    for key, group in groupby(res, lambda x: x['timestamp'].date()):
-        kernels, inputs, outputs = 0, 0, 0
-        for block in group:
-            kernels += block['kernels_count']
-            inputs += block['inputs_count']
-            outputs += block['outputs_count']
-        tx_graph_data.append({
-            'date': str(key),
-            'kernels': kernels,
-            'inputs': inputs,
-            'outputs': outputs,
-        })
-    # reverse it so that you have increasing by date
-    return list(reversed(tx_graph_data))
+        .order_by('start')
+    return [
+        {
+            'date': str(stats.start.date()),
+            'kernels': stats.nr_kernels,
+            'inputs': stats.nr_inputs,
+            'outputs': stats.nr_outputs,
+        }
+        for stats in daily_stats
+    ]
+
+
+def _get_metric_value(metric, bucket, prev_bucket):
+    if metric == 'blocks':
+        return bucket.nr_blocks
+    if metric == 'transactions':
+        # every transaction has at least one non-coinbase kernel
+        return bucket.nr_kernels - bucket.nr_coinbase_kernels
+    if metric == 'kernels':
+        return bucket.nr_kernels
+    if metric == 'inputs':
+        return bucket.nr_inputs
+    if metric == 'outputs':
+        return bucket.nr_outputs
+    if metric == 'fees':
+        return bucket.fees
+    if metric == 'average_fee':
+        nr_transactions = bucket.nr_kernels - bucket.nr_coinbase_kernels
+        if not nr_transactions:
+            return None
+        return bucket.fees // nr_transactions
+    if metric == 'block_interval':
+        # average seconds between blocks, the first block of the bucket is
+        # compared with the last block of the previous bucket
+        if prev_bucket:
+            duration = bucket.last_timestamp - prev_bucket.last_timestamp
+            return duration.total_seconds() / bucket.nr_blocks
+        if bucket.nr_blocks > 1:
+            duration = bucket.last_timestamp - bucket.first_timestamp
+            return duration.total_seconds() / (bucket.nr_blocks - 1)
+        return None
+    if metric == 'difficulty':
+        # average difficulty of the bucket's blocks
+        if not prev_bucket:
+            return None
+        difficulty = bucket.total_difficulty - prev_bucket.total_difficulty
+        return difficulty // bucket.nr_blocks
+    if metric == 'hashrate':
+        # difficulty per second since the end of the previous bucket
+        if not prev_bucket:
+            return None
+        difficulty = bucket.total_difficulty - prev_bucket.total_difficulty
+        duration = bucket.last_timestamp - prev_bucket.last_timestamp
+        if not duration.total_seconds():
+            return None
+        return difficulty / duration.total_seconds()
+    if metric == 'kernel_features':
+        return {
+            'plain': bucket.nr_plain_kernels,
+            'coinbase': bucket.nr_coinbase_kernels,
+            'height_locked': bucket.nr_height_locked_kernels,
+            'no_recent_duplicate': bucket.nr_no_recent_duplicate_kernels,
+        }
+    if metric == 'supply':
+        return get_supply(bucket.last_height)
+    if metric == 'emission':
+        return bucket.nr_blocks * settings.BLOCK_REWARD
+
 
+def get_timeseries_data(blockchain, resolution, start, end, metrics):
+    """
+    Returns points of the given metrics for buckets of the given resolution
+    which start in [start, end).
+    """
+    base_qs = StatsBucket.objects.filter(
+        blockchain=blockchain, resolution=resolution)
+    buckets = list(
+        base_qs.filter(start__gte=start, start__lt=end).order_by('start'))
+    # interval and difficulty of the first bucket depend on the previous one
+    prev_bucket = base_qs.filter(start__lt=start).order_by('-start').first()
+    points = []
+    for bucket in buckets:
+        point = {'start': bucket.start}
+        for metric in metrics:
+            point[metric] = _get_metric_value(metric, bucket, prev_bucket)
+        points.append(point)
+        prev_bucket = bucket
+    return points
@@ -1,11 +1,18 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from decimal import Decimal
 from django.conf import settings
-from backend.api.models import Input, Output, Block, Reorg
+from django.db import connection
+from django.db.models import Q
+from redis.exceptions import LockNotOwnedError
+from backend.api.models import Input, Output, Block, Reorg, UnspentOutput
+from .chain_index import ChainIndex
 from .mixins import DefaultMixin
 from .node import NodeV2API, NodeBlockNotFoundException
 
 import json
 import logging
+import re
 import redis
 import requests
 
@@ -14,20 +21,311 @@ logger = logging.getLogger(__name__)
 
 node_cache = {}
 
+# marks blocks from the reorg's end back to its start as reorged, the chain is
+# followed through prev_hash since the new main chain has blocks at the same
+# heights
+REORG_BLOCKS_SQL = """
+WITH RECURSIVE reorged AS (
+    SELECT hash, prev_hash
+    FROM api_block
+    WHERE hash = %(end_reorg_hash)s
+    UNION ALL
+    SELECT b.hash, b.prev_hash
+    FROM api_block b
+    JOIN reorged r ON b.hash = r.prev_hash
+    WHERE b.height >= %(start_reorg_height)s
+)
+UPDATE api_block b
+SET
+    reorg_id = %(reorg_id)s,
+    modified = NOW()
+FROM reorged r
+WHERE b.hash = r.hash
+RETURNING b.height, b.timestamp;
+"""
 
-def get_blocks_between(start_block, end_block):
-    """Returns sorted blocks from start_block to end_block, including both."""
-    blocks = []
-    cur_block = start_block
-    while cur_block != end_block:
-        blocks.append(cur_block)
-        cur_block = cur_block.get_next_block()
-    if start_block != end_block:
-        blocks.append(cur_block)
-    return blocks
+# moves reorged blocks on the new main chain back to it. The new main chain is
+# the path from start_main_block to its highest descendant, the walk doesn't go
+# above the highest block of older reorgs since blocks above it are not
+# reorged. Returns the reorgs the blocks were part of.
+UNREORG_MAIN_BLOCKS_SQL = """
+WITH RECURSIVE descendants AS (
+    SELECT hash, height, reorg_id
+    FROM api_block
+    WHERE hash = %(start_main_hash)s
+    UNION ALL
+    SELECT b.hash, b.height, b.reorg_id
+    FROM api_block b
+    JOIN descendants d ON b.prev_hash = d.hash
+    WHERE
+        b.blockchain_id = %(blockchain_id)s AND
+        b.height <= (
+            SELECT MAX(height)
+            FROM api_block
+            WHERE
+                blockchain_id = %(blockchain_id)s AND
+                reorg_id <> %(reorg_id)s AND
+                height > %(start_main_height)s
+        )
+), tip AS (
+    SELECT hash
+    FROM descendants
+    ORDER BY height DESC, reorg_id IS NOT NULL, hash
+    LIMIT 1
+), main_chain AS (
+    SELECT b.hash, b.prev_hash
+    FROM api_block b
+    JOIN tip t ON b.hash = t.hash
+    UNION ALL
+    SELECT b.hash, b.prev_hash
+    FROM api_block b
+    JOIN main_chain m ON b.hash = m.prev_hash
+    WHERE b.height >= %(start_main_height)s
+), reorged AS (
+    SELECT b.hash, b.reorg_id
+    FROM api_block b
+    JOIN main_chain m ON b.hash = m.hash
+    WHERE b.reorg_id IS NOT NULL
+)
+UPDATE api_block b
+SET
+    reorg_id = NULL,
+    modified = NOW()
+FROM reorged r
+WHERE b.hash = r.hash
+RETURNING b.height, b.timestamp, r.reorg_id;
+"""
+
+# deletes the given reorgs which have no blocks left
+DELETE_EMPTY_REORGS_SQL = """
+DELETE FROM api_reorg r
+WHERE
+    r.id = ANY(%(reorg_ids)s) AND
+    NOT EXISTS (SELECT 1 FROM api_block b WHERE b.reorg_id = r.id);
+"""
+
+# heights of main chain blocks whose prev_hash doesn't match the hash of the
+# main chain block right below them and heights with more than one main chain
+# block, it's a single ordered scan of the chain
+BROKEN_LINKS_SQL = """
+SELECT DISTINCT height
+FROM (
+    SELECT
+        height,
+        prev_hash,
+        LAG(height) OVER w AS prev_height,
+        LAG(hash) OVER w AS prev_block_hash,
+        COUNT(*) OVER (PARTITION BY height) AS nr_blocks
+    FROM api_block
+    WHERE
+        blockchain_id = %(blockchain_id)s AND
+        reorg_id IS NULL
+    WINDOW w AS (ORDER BY height)
+) x
+WHERE
+    nr_blocks > 1 OR (
+        prev_height = height - 1 AND
+        prev_hash IS DISTINCT FROM prev_block_hash
+    )
+ORDER BY height;
+"""
+
+# adds main chain outputs which are not spent to the UTXO set
+INSERT_UNSPENT_OUTPUTS_SQL = """
+INSERT INTO api_unspentoutput (blockchain_id, commitment, output_id)
+SELECT b.blockchain_id, o.commitment, o.id
+FROM api_output o
+JOIN api_block b ON b.hash = o.block_id
+WHERE
+    b.blockchain_id = %(blockchain_id)s AND
+    b.reorg_id IS NULL AND
+    NOT o.spent
+    {commitment_filter}
+ON CONFLICT DO NOTHING;
+"""
+
+
+# reorged outputs are spent only when an input in the reorg spends them, such
+# inputs get linked to them
+FIX_REORGED_OUTPUTS_SQL = """
+UPDATE api_output o
+SET spent = EXISTS (
+    SELECT 1
+    FROM api_input i
+    WHERE
+        i.block_id = ANY(%(reorged_hashes)s) AND
+        i.commitment = o.commitment
+)
+WHERE o.block_id = ANY(%(reorged_hashes)s);
+
+UPDATE api_input i
+SET output_id = o.id
+FROM api_output o
+WHERE
+    i.block_id = ANY(%(reorged_hashes)s) AND
+    o.block_id = ANY(%(reorged_hashes)s) AND
+    o.commitment = i.commitment AND
+    i.output_id IS DISTINCT FROM o.id;
+"""
+
+# reorged inputs which spend outputs from before the reorg get linked to the
+# main chain outputs, which are marked as not spent (main chain inputs which
+# spend them fix this later)
+FIX_REORGED_INPUTS_SQL = """
+WITH main_outputs AS (
+    SELECT DISTINCT ON (o.commitment) o.commitment, o.id
+    FROM api_output o
+    JOIN api_block b ON b.hash = o.block_id
+    WHERE
+        b.blockchain_id = %(blockchain_id)s AND
+        b.reorg_id IS NULL AND
+        o.commitment IN (
+            SELECT commitment
+            FROM api_input
+            WHERE block_id = ANY(%(reorged_hashes)s)
+        )
+    ORDER BY o.commitment, o.id
+), linked AS (
+    UPDATE api_input i
+    SET output_id = m.id
+    FROM main_outputs m
+    WHERE
+        i.block_id = ANY(%(reorged_hashes)s) AND
+        i.commitment = m.commitment AND
+        NOT EXISTS (
+            SELECT 1
+            FROM api_output o
+            WHERE
+                o.block_id = ANY(%(reorged_hashes)s) AND
+                o.commitment = i.commitment
+        )
+    RETURNING m.id
+)
+UPDATE api_output
+SET spent = FALSE
+WHERE id IN (SELECT id FROM linked);
+"""
 
+# main chain inputs from the reorg's start on get linked to the main chain
+# outputs, which are marked as spent
+FIX_MAIN_INPUTS_SQL = """
+WITH main_outputs AS (
+    SELECT DISTINCT ON (o.commitment) o.commitment, o.id
+    FROM api_output o
+    JOIN api_block b ON b.hash = o.block_id
+    WHERE
+        b.blockchain_id = %(blockchain_id)s AND
+        b.reorg_id IS NULL AND
+        o.commitment = ANY(%(commitments)s)
+    ORDER BY o.commitment, o.id
+), linked AS (
+    UPDATE api_input i
+    SET output_id = m.id
+    FROM main_outputs m, api_block b
+    WHERE
+        b.hash = i.block_id AND
+        b.blockchain_id = %(blockchain_id)s AND
+        b.reorg_id IS NULL AND
+        b.height >= %(start_height)s AND
+        i.commitment = m.commitment
+    RETURNING m.id
+)
+UPDATE api_output
+SET spent = TRUE
+WHERE id IN (SELECT id FROM linked);
+"""
 
-def fix_outputs_and_inputs_from_reorg(reorg):
+
+def reassign_reorg_blocks(reorg):
+    """
+    Moves blocks of the given (new) reorg out of the main chain and blocks of
+    the new main chain, which were part of older reorgs, back into it. Older
+    reorgs which are left without blocks are deleted. Returns a set of
+    (height, timestamp) pairs of blocks which moved.
+    """
+    params = {
+        'blockchain_id': reorg.blockchain_id,
+        'reorg_id': reorg.id,
+        'end_reorg_hash': reorg.end_reorg_block_id,
+        'start_reorg_height': reorg.start_reorg_block.height,
+        'start_main_hash': reorg.start_main_block_id,
+        'start_main_height': reorg.start_main_block.height,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(REORG_BLOCKS_SQL, params)
+        moved = set(cursor.fetchall())
+        cursor.execute(UNREORG_MAIN_BLOCKS_SQL, params)
+        main_rows = cursor.fetchall()
+        old_reorg_ids = list({reorg_id for _, _, reorg_id in main_rows})
+        if old_reorg_ids:
+            cursor.execute(
+                DELETE_EMPTY_REORGS_SQL, {'reorg_ids': old_reorg_ids})
+    moved |= {(height, timestamp) for height, timestamp, _ in main_rows}
+    return moved
+
+
+# sets main chain block which spends each of the given outputs
+SYNC_SPENT_IN_BLOCKS_SQL = """
+UPDATE api_output o
+SET
+    spent_in_block_id = x.block_id,
+    spent_height = x.height
+FROM (
+    SELECT DISTINCT ON (o.id) o.id, ib.hash AS block_id, ib.height
+    FROM api_output o
+    JOIN api_block b ON b.hash = o.block_id
+    LEFT JOIN (
+        api_input i JOIN api_block ib ON ib.hash = i.block_id AND ib.reorg_id IS NULL
+    ) ON i.output_id = o.id
+    WHERE
+        b.blockchain_id = %(blockchain_id)s AND
+        o.commitment = ANY(%(commitments)s)
+    ORDER BY o.id, ib.height
+) x
+WHERE
+    o.id = x.id AND
+    (
+        o.spent_in_block_id IS DISTINCT FROM x.block_id OR
+        o.spent_height IS DISTINCT FROM x.height
+    );
+"""
+
+
+def sync_spent_in_blocks(blockchain, commitments):
+    """
+    Syncs Output.spent_in_block and Output.spent_height of outputs with the
+    given commitments with main chain inputs which spend them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            SYNC_SPENT_IN_BLOCKS_SQL,
+            {'blockchain_id': blockchain.id, 'commitments': list(commitments)},
+        )
+
+
+def sync_unspent_outputs(blockchain, commitments=None):
+    """
+    Syncs UTXO set entries of the given commitments with the outputs, when
+    commitments are not given the whole UTXO set is rebuilt.
+    """
+    unspent_outputs = UnspentOutput.objects.filter(blockchain=blockchain)
+    params = {'blockchain_id': blockchain.id}
+    commitment_filter = ''
+    if commitments is not None:
+        params['commitments'] = list(commitments)
+        unspent_outputs = unspent_outputs.filter(
+            commitment__in=params['commitments'])
+        commitment_filter = 'AND o.commitment = ANY(%(commitments)s)'
+    unspent_outputs.delete()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            INSERT_UNSPENT_OUTPUTS_SQL.format(
+                commitment_filter=commitment_filter),
+            params,
+        )
+
+
+def fix_outputs_and_inputs_from_reorg(reorg, end_height=None):
     """
     Fix Output.spent and Input.output on instances that were affected by the
     given reorg. Note that due to the order of block fetching (sometimes
@@ -38,147 +336,215 @@ def fix_outputs_and_inputs_from_reorg(reorg):
     because it doesn't yet know that it's a part of a reorg (due to the way we
     implemented things). We also need to fix outputs which were spent in a reorg
     but not in the main chain and vice-versa.
+    'end_height' is the height of the highest block which joined the main chain
+    because of this reorg, it defaults to the height of the reorg's end.
     """
-    # solve reorged part
-    reorged_blocks = get_blocks_between(
-        reorg.start_reorg_block, reorg.end_reorg_block)
-    reorg_inputs = Input.objects.filter(block__in=reorged_blocks)
-    reorg_outputs = Output.objects.filter(block__in=reorged_blocks)
-    for output in reorg_outputs:
-        matching_input = reorg_inputs\
-            .filter(commitment=output.commitment)\
-            .first()
-        output.spent = False
-        if matching_input:
-            output.spent = True
-            matching_input.output = output
-            matching_input.save()
-        output.save()
-
-    # NOTE: some redundancy in this loop, but reorgs are rare so it's ok
-    for input in reorg_inputs:
-        matching_output = reorg_outputs\
-            .filter(commitment=input.commitment)\
-            .first()
-        if not matching_output:
-            # part of the main chain before the reorg happened, fix it there
-            matching_output = Output.objects.filter(
-                block__reorg=None, commitment=input.commitment).first()
-            if matching_output:
-                matching_output.spent = False
-                matching_output.save()
-                input.output = matching_output
-                input.save()
-    # solve main part
-    main_blocks = Block.objects\
-        .filter(height__gte=reorg.start_main_block.height, reorg=None)\
-        .order_by('height')
-    for block in main_blocks:
-        for input in block.inputs.all():
-            matching_output = Output.objects.filter(
-                block__reorg=None, commitment=input.commitment).first()
-            if matching_output:
-                matching_output.spent = True
-                matching_output.save()
-                input.output = matching_output
-                input.save()
-
-
-def check_for_reorg(new_block, update_progress_fn, missing_heights, start_height):
+    blockchain = reorg.blockchain
+    start_height = reorg.start_main_block.height
+    if end_height is None:
+        end_height = reorg.end_reorg_block.height
+    reorged_hashes = list(
+        Block.objects.filter(reorg=reorg).values_list('hash', flat=True))
+    # only inputs and outputs with commitments from blocks which left or joined
+    # the main chain can change
+    affected_blocks = Q(block__reorg=reorg) | Q(
+        block__blockchain=blockchain,
+        block__reorg=None,
+        block__height__gte=start_height,
+        block__height__lte=end_height,
+    )
+    output_commitments = Output.objects\
+        .filter(affected_blocks)\
+        .values_list('commitment', flat=True)
+    input_commitments = Input.objects\
+        .filter(affected_blocks)\
+        .values_list('commitment', flat=True)
+    commitments = set(output_commitments) | set(input_commitments)
+    params = {
+        'blockchain_id': blockchain.id,
+        'reorged_hashes': reorged_hashes,
+        'start_height': start_height,
+        'commitments': list(commitments),
+    }
+    with connection.cursor() as cursor:
+        # solve reorged part
+        cursor.execute(FIX_REORGED_OUTPUTS_SQL, params)
+        cursor.execute(FIX_REORGED_INPUTS_SQL, params)
+        # solve main part
+        cursor.execute(FIX_MAIN_INPUTS_SQL, params)
+    sync_spent_in_blocks(blockchain, commitments)
+    sync_unspent_outputs(blockchain, commitments)
+
+
+def check_for_reorg(
+    new_block, update_progress_fn, renew_lock_fn, missing_heights, chain_index
+):
     """
     Checks if new_block is part of a reorg. Return tuple (reorg, set<heights>)
     where reorg is Reorg instance or None, set<heights> is a set of heights of
     blocks that were fetched in during this reorg checking process.
+    Linkage is checked against chain_index (ChainIndex of the main chain),
+    which is kept up to date with the fetched blocks, new_block included. A
+    main block which new_block replaced at its height is reorged too.
+    renew_lock_fn is called before each fetched block to renew the caller's
+    ingestion lock.
     """
     # import here to avoid cyclic import
-    from .bootstrap import fetch_and_store_block
+    from .bootstrap import get_or_fetch_block
     blockchain = new_block.blockchain
     fetched_heights = set()
+    # hashes of reorged blocks
     reorged_blocks = []
     reorg = None
+
+    def fetch_block(height, hash=None):
+        renew_lock_fn()
+        # only download the block if we don't have it yet
+        block = get_or_fetch_block(blockchain, height, hash=hash)
+        chain_index.set(block.height, block.hash, block.prev_hash)
+        return block
+
+    replaced_hash = None
+    if chain_index.get(new_block.height):
+        # the index has one of the main blocks at this height, there can be
+        # more if new_block was stored next to a stale one
+        replaced_hash = blockchain.blocks\
+            .filter(height=new_block.height, reorg=None)\
+            .exclude(hash=new_block.hash)\
+            .values_list('hash', flat=True)\
+            .first()
+    chain_index.set(new_block.height, new_block.hash, new_block.prev_hash)
     # find reorged blocks backward
     cur_block = new_block
     while True:
-        prev_block = blockchain.blocks\
-            .filter(height=cur_block.height - 1, reorg__isnull=True)\
-            .first()
+        prev_block = chain_index.get(cur_block.height - 1)
         if prev_block:
-            if cur_block.prev_hash == prev_block.hash:
+            prev_hash, _ = prev_block
+            if cur_block.prev_hash == prev_hash:
                 break
-            reorged_blocks.append(prev_block)
-            # fetch the new block at this height
-            cur_block = fetch_and_store_block(
-                blockchain, prev_block.height)
+            reorged_blocks.append(prev_hash)
+            # the new block at this height is the one cur_block links to
+            cur_block = fetch_block(
+                cur_block.height - 1, hash=cur_block.prev_hash)
             # mark height as reorged so that we don't go through it again
             # when looping through 'missing_heights'
-            if prev_block.height in missing_heights:
-                fetched_heights.add(prev_block.height)
+            if cur_block.height in missing_heights:
+                fetched_heights.add(cur_block.height)
                 update_progress_fn(fetched_heights)
         else:
-            try:
-                # we still need to check for a case where current block
-                # is at height X, we are missing height X-1 in our DB
-                # but have height X-2 where X-2 in our DB has been
-                # reorged
-                if cur_block.height - 1 < start_height:
-                    break
-                cur_block = fetch_and_store_block(
-                    blockchain, cur_block.height - 1)
-                if cur_block:
-                    # mark height as reorged so that we don't go through it
-                    # again when looping through 'missing_heights'
-                    if cur_block.height in missing_heights:
-                        fetched_heights.add(cur_block.height)
-                        update_progress_fn(fetched_heights)
-                        # we assume the reorg is not bigger than 1000 blocks,
-                        # so we break if needed (this check_for_reorg is much
-                        # slower at fetching because it does a db lookup in each
-                        # loop, that's why we want to leave it if possible)
-                        if len(fetched_heights) > 1000 and not reorged_blocks:
-                            break
-            except NodeBlockNotFoundException:
-                # the node probably dropped that height so that's where we stop
-                logger.info(
-                    'check reorg backward block not found',
-                    extra={'height': cur_block.height - 1},
-                )
-                break
+            # the parent height is missing, it's fetched and checked later by
+            # the caller which loads missing heights in descending order
+            break
     # reverse reorged_blocks so that we have them ascending by height
     reorged_blocks.reverse()
+    if replaced_hash:
+        reorged_blocks.append(replaced_hash)
     # store the first block in the new "main" chain
     start_main_block = cur_block
     # find reorged blocks forward
     cur_block = new_block
     # we know that we have fetched all the later blocks because we fetch
     # missing blocks in order (descending by height)
-    next_block = blockchain.blocks\
-        .filter(height=cur_block.height + 1, reorg__isnull=True)\
-        .first()
+    next_block = chain_index.get(cur_block.height + 1)
     while next_block:
-        if next_block.prev_hash == cur_block.hash:
+        next_hash, next_prev_hash = next_block
+        if next_prev_hash == cur_block.hash:
             break
         # next_block has been reorged
-        reorged_blocks.append(next_block)
+        reorged_blocks.append(next_hash)
         # fetch the new block at this height
-        cur_block = fetch_and_store_block(blockchain, next_block.height)
+        cur_block = fetch_block(cur_block.height + 1)
         # mark height as reorged so that we don't go through it again when
         # looping through 'missing_heights'
         if cur_block.height in missing_heights:
             fetched_heights.add(cur_block.height)
             update_progress_fn(fetched_heights)
-        next_block = blockchain.blocks\
-            .filter(height=cur_block.height + 1, reorg__isnull=True)\
-            .first()
+        next_block = chain_index.get(cur_block.height + 1)
     if reorged_blocks:
         reorg = Reorg.objects.create(
             blockchain=blockchain,
-            start_reorg_block=reorged_blocks[0],
-            end_reorg_block=reorged_blocks[-1],
+            start_reorg_block_id=reorged_blocks[0],
+            end_reorg_block_id=reorged_blocks[-1],
             start_main_block=start_main_block,
         )
     return reorg, fetched_heights
 
 
+def get_broken_links(blockchain):
+    """
+    Returns ranges [start, end] of heights of main chain blocks which are not
+    linked to the main chain block below them or which share their height with
+    another main chain block. Missing heights are not considered broken.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(BROKEN_LINKS_SQL, {'blockchain_id': blockchain.id})
+        heights = [height for height, in cursor.fetchall()]
+    return get_height_ranges(heights)
+
+
+def get_height_ranges(heights):
+    """
+    Groups the given ascending heights into ranges [start, end] of
+    consecutive heights.
+    """
+    ranges = []
+    for height in heights:
+        if ranges and ranges[-1][1] == height - 1:
+            ranges[-1][1] = height
+        else:
+            ranges.append([height, height])
+    return ranges
+
+
+def repair_broken_links(blockchain, ranges):
+    """
+    Gets the node's block at the highest height of each of the given ranges
+    of broken links and checks it for a reorg, which fixes the blocks around
+    it. Only blocks we don't have yet are downloaded.
+    Returns created Reorg instances.
+    """
+    # import here to avoid cyclic import
+    from .bootstrap import get_or_fetch_block
+    if not ranges:
+        return []
+    # prefetched blocks might be the stale ones
+    node_cache.pop(blockchain.node.slug, None)
+    start_height = blockchain.blocks\
+        .filter(reorg=None)\
+        .order_by('height')\
+        .values_list('height', flat=True)\
+        .first()
+    end_height = max(end for _, end in ranges)
+    reorgs = []
+    # other writers must not change the chain while it's being repaired
+    lock = get_ingestion_lock(blockchain.slug)
+    lock.acquire()
+    try:
+        chain_index = ChainIndex.load(blockchain, start_height, end_height + 1)
+        for _, end in sorted(ranges, reverse=True):
+            lock.reacquire()
+            new_block = get_or_fetch_block(blockchain, end)
+            reorg, _ = check_for_reorg(
+                new_block,
+                lambda heights: None,
+                lock.reacquire,
+                set(),
+                chain_index,
+            )
+            if reorg:
+                reorgs.append(reorg)
+    except LockNotOwnedError:
+        # the lock expired and another writer took it, it must not race with
+        # it so the rest is left to the next repair
+        logger.warning(
+            'Ingestion lock lost, repair aborted',
+            extra={'blockchain': blockchain.slug},
+        )
+    finally:
+        release_ingestion_lock(lock)
+    return reorgs
+
+
 def get_filter_backends(replacements):
     """
     Returns a tuple of filter backends where default ones, from DefaultMixin,
@@ -271,6 +637,191 @@ def get_missing_heights_repr(missing_heights):
     ))
 
 
+def get_blockchain_group_name(blockchain_slug):
+    """
+    Returns name of the channels group whose members get the blockchain's
+    new blocks or None if the slug can't be a part of a group name.
+    """
+    if not isinstance(blockchain_slug, str):
+        return None
+    group = f'blockchain__{blockchain_slug}'
+    if len(group) >= 100 or not re.fullmatch(r'[a-zA-Z0-9\-_.]+', group):
+        return None
+    return group
+
+
+def enqueue_accepted_height(blockchain_slug, height):
+    """Adds the height to the blockchain's queue of accepted blocks."""
+    enqueue_accepted_heights(blockchain_slug, [height])
+
+
+def enqueue_accepted_heights(blockchain_slug, heights):
+    """Adds the heights to the blockchain's queue of accepted blocks."""
+    r = redis.Redis(host='redis')
+    key = settings.ACCEPTED_BLOCKS_REDIS_KEY.format(blockchain_slug)
+    r.zadd(key, {height: height for height in heights})
+
+
+def has_accepted_heights(blockchain_slug):
+    """Returns True if the blockchain's queue of accepted blocks isn't empty."""
+    r = redis.Redis(host='redis')
+    key = settings.ACCEPTED_BLOCKS_REDIS_KEY.format(blockchain_slug)
+    return r.zcard(key) > 0
+
+
+def get_ingestion_lock(blockchain_slug):
+    """
+    Returns the blockchain's redis lock which must be held while storing its
+    blocks, so that bootstrap, accepted blocks and repairs don't race.
+    """
+    r = redis.Redis(host='redis')
+    return r.lock(
+        settings.INGESTION_LOCK_KEY.format(blockchain_slug),
+        timeout=settings.INGESTION_LOCK_TIMEOUT,
+    )
+
+
+def release_ingestion_lock(lock):
+    """
+    Releases the ingestion lock unless it expired and was taken by another
+    writer meanwhile.
+    """
+    try:
+        lock.release()
+    except LockNotOwnedError:
+        pass
+
+
+def pop_accepted_heights(blockchain_slug, count):
+    """
+    Removes and returns up to 'count' lowest heights from the blockchain's
+    queue of accepted blocks, sorted ascending.
+    """
+    r = redis.Redis(host='redis')
+    key = settings.ACCEPTED_BLOCKS_REDIS_KEY.format(blockchain_slug)
+    return [int(height) for height, _ in r.zpopmin(key, count)]
+
+
+def send_websocket_message(group, msg_type, message):
+    """
+    Sends the message to the consumers of the group. It's serialized once
+    here and the consumers forward the text to their clients as it is.
+    """
+    async_to_sync(get_channel_layer().group_send)(
+        group,
+        {
+            'type': 'forward',
+            'text': json.dumps({'type': msg_type, 'message': message}),
+        }
+    )
+
+
+def store_blockchain_snapshot(blockchain_slug, text):
+    r = redis.Redis(host='redis')
+    r.set(settings.WS_SNAPSHOT_KEY.format(blockchain_slug), text)
+
+
+def load_blockchain_snapshot(blockchain_slug):
+    """Returns the blockchain's pre-rendered snapshot text or None."""
+    r = redis.Redis(host='redis')
+    text = r.get(settings.WS_SNAPSHOT_KEY.format(blockchain_slug))
+    if text is None:
+        return
+    return text.decode('utf-8')
+
+
+def delete_blockchain_snapshot(blockchain_slug):
+    r = redis.Redis(host='redis')
+    r.delete(settings.WS_SNAPSHOT_KEY.format(blockchain_slug))
+
+
+def _schedule_broadcast(r, blockchain_slug):
+    # only the first event within an interval schedules the broadcast, the
+    # flag expires in case the worker dies before sending it
+    key = settings.WS_BROADCAST_SCHEDULED_KEY.format(blockchain_slug)
+    if r.set(key, 1, nx=True, ex=60):
+        # import here to avoid cyclic import
+        from .tasks import flush_broadcasts
+        flush_broadcasts.send_with_options(
+            args=(blockchain_slug,), delay=settings.WS_BROADCAST_INTERVAL)
+
+
+def queue_blocks_broadcast(blockchain_slug, blocks_data, nr_blocks, reorged):
+    """
+    Queues new blocks of the blockchain to be sent to clients with the next
+    coalesced broadcast. Only the latest WS_NEW_BLOCKS_LIMIT blocks are kept.
+    """
+    r = redis.Redis(host='redis')
+    key = settings.WS_PENDING_BROADCAST_KEY.format(blockchain_slug)
+    blocks_key = settings.WS_PENDING_BLOCKS_KEY.format(blockchain_slug)
+    pipe = r.pipeline()
+    pipe.hincrby(key, 'nr_blocks', nr_blocks)
+    if reorged:
+        pipe.hset(key, 'reorged', 1)
+    if blocks_data:
+        pipe.rpush(blocks_key, *[json.dumps(data) for data in blocks_data])
+        pipe.ltrim(blocks_key, -settings.WS_NEW_BLOCKS_LIMIT, -1)
+    pipe.execute()
+    _schedule_broadcast(r, blockchain_slug)
+
+
+def queue_progress_broadcast(blockchain_slug, load_progress):
+    """
+    Queues load progress of the blockchain to be sent to admins with the next
+    coalesced broadcast, it replaces the previously queued progress.
+    """
+    r = redis.Redis(host='redis')
+    key = settings.WS_PENDING_BROADCAST_KEY.format(blockchain_slug)
+    r.hset(key, 'load_progress', str(load_progress))
+    _schedule_broadcast(r, blockchain_slug)
+
+
+def pop_pending_broadcast(blockchain_slug):
+    """
+    Removes and returns events queued for the blockchain's broadcast as a
+    dict with optional keys 'nr_blocks', 'blocks', 'reorged' and
+    'load_progress'.
+    """
+    r = redis.Redis(host='redis')
+    # clear the flag first so that events queued from now on schedule a new
+    # broadcast
+    r.delete(settings.WS_BROADCAST_SCHEDULED_KEY.format(blockchain_slug))
+    key = settings.WS_PENDING_BROADCAST_KEY.format(blockchain_slug)
+    blocks_key = settings.WS_PENDING_BLOCKS_KEY.format(blockchain_slug)
+    pipe = r.pipeline()
+    pipe.hgetall(key)
+    pipe.lrange(blocks_key, 0, -1)
+    pipe.delete(key, blocks_key)
+    pending, blocks, _ = pipe.execute()
+    res = {}
+    if b'nr_blocks' in pending:
+        res['nr_blocks'] = int(pending[b'nr_blocks'])
+        res['blocks'] = [json.loads(data) for data in blocks]
+    if b'reorged' in pending:
+        res['reorged'] = True
+    if b'load_progress' in pending:
+        res['load_progress'] = float(pending[b'load_progress'])
+    return res
+
+
+def prefetch_blocks(node, heights):
+    """
+    Fetches blocks at the given ascending heights, each range of consecutive
+    heights in requests of up to 1000 blocks, and caches them all for
+    get_prefetched_header_and_block_data.
+    """
+    node_api = NodeV2API(node)
+    # replace the existing cache, it's likely not going to be used anymore
+    cache = {}
+    for start_height, end_height in get_height_ranges(heights):
+        for start in range(start_height, end_height + 1, 1000):
+            fetched_blocks = node_api.get_blocks(
+                start, min(start + 999, end_height))['blocks']
+            for block in fetched_blocks:
+                cache[block['header']['height']] = block
+    node_cache[node.slug] = cache
+
+
 def get_prefetched_header_and_block_data(node, height):
     if node.slug not in node_cache or height not in node_cache[node.slug]:
         node_api = NodeV2API(node)
@@ -284,4 +835,3 @@ def get_prefetched_header_and_block_data(node, height):
     if height not in node_cache[node.slug]:
         raise NodeBlockNotFoundException()
     return node_cache[node.slug][height]
-
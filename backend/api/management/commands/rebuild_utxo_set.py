@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from backend.api.helpers import sync_unspent_outputs
+from backend.api.models import Blockchain
+
+
+class Command(BaseCommand):
+    help = 'Rebuild UTXO set of the given blockchain from its outputs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('blockchain_slug')
+
+    def handle(self, *args, **kwargs):
+        try:
+            blockchain = Blockchain.objects.get(slug=kwargs['blockchain_slug'])
+        except Blockchain.DoesNotExist:
+            raise CommandError('Blockchain does not exist')
+        with transaction.atomic():
+            sync_unspent_outputs(blockchain)
+        self.stdout.write(self.style.SUCCESS(
+            'UTXO set size: {}'.format(blockchain.unspent_outputs.count())))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from backend.api.helpers import get_broken_links, repair_broken_links
+from backend.api.models import Blockchain
+from backend.api.tasks import verify_chain_linkage_task
+
+
+class Command(BaseCommand):
+    help = 'Verify prev_hash linkage of the main chain of the given blockchain'
+
+    def add_arguments(self, parser):
+        parser.add_argument('blockchain_slug')
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Refetch blocks around broken links from the node',
+        )
+        parser.add_argument(
+            '--background',
+            action='store_true',
+            help='Run it as a dramatiq task',
+        )
+
+    def handle(self, *args, **kwargs):
+        try:
+            blockchain = Blockchain.objects.get(slug=kwargs['blockchain_slug'])
+        except Blockchain.DoesNotExist:
+            raise CommandError('Blockchain does not exist')
+        if kwargs['background']:
+            verify_chain_linkage_task.send(blockchain.slug, kwargs['repair'])
+            self.stdout.write(self.style.SUCCESS('Task sent'))
+            return
+        broken_links = get_broken_links(blockchain)
+        if not broken_links:
+            self.stdout.write(self.style.SUCCESS('Main chain is linked'))
+            return
+        self.stdout.write(self.style.WARNING(
+            'Broken links at heights: {}'.format(broken_links)))
+        if kwargs['repair']:
+            reorgs = repair_broken_links(blockchain, broken_links)
+            self.stdout.write(self.style.SUCCESS(
+                'Created reorgs: {}, broken links left: {}'.format(
+                    len(reorgs), get_broken_links(blockchain))))
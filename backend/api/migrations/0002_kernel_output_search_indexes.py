@@ -0,0 +1,31 @@
+# Generated by Django 4.1.3 on 2026-10-19 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='kernel',
+            name='excess',
+            field=models.CharField(max_length=66),
+        ),
+        migrations.AlterField(
+            model_name='output',
+            name='commitment',
+            field=models.CharField(max_length=66),
+        ),
+        migrations.AddIndex(
+            model_name='kernel',
+            index=models.Index(fields=['excess', 'block'], name='kernel_excess_block_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='output',
+            index=models.Index(fields=['commitment', 'block'], name='output_commitment_block_idx'),
+        ),
+    ]
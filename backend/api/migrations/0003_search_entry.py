@@ -0,0 +1,52 @@
+# Generated by Django 4.1.3 on 2026-10-19 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# fill the search index with already stored data, it's done before the index
+# is created since that's faster
+FILL_SEARCH_ENTRIES_SQL = """
+INSERT INTO api_searchentry (blockchain_id, term, type, block_id, height)
+SELECT blockchain_id, hash, 'block', hash, height
+FROM api_block;
+
+INSERT INTO api_searchentry (blockchain_id, term, type, block_id, height)
+SELECT b.blockchain_id, k.excess, 'kernel', b.hash, b.height
+FROM api_kernel k
+JOIN api_block b ON b.hash = k.block_id;
+
+INSERT INTO api_searchentry (blockchain_id, term, type, block_id, height)
+SELECT b.blockchain_id, o.commitment, 'output', b.hash, b.height
+FROM api_output o
+JOIN api_block b ON b.hash = o.block_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_kernel_output_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('term', models.CharField(max_length=66)),
+                ('type', models.CharField(choices=[('block', 'Block'), ('kernel', 'Kernel'), ('output', 'Output')], max_length=255)),
+                ('height', models.PositiveIntegerField()),
+                ('block', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='api.block')),
+                ('blockchain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='api.blockchain')),
+            ],
+        ),
+        migrations.RunSQL(
+            FILL_SEARCH_ENTRIES_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='searchentry',
+            index=models.Index(fields=['blockchain', 'term'], name='search_entry_term_idx', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+    ]
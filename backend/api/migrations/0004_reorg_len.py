@@ -0,0 +1,47 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:02
+
+from django.db import migrations, models
+
+
+# set reorg_len and start_main_height on already stored reorgs
+FILL_REORG_LEN_SQL = """
+UPDATE api_reorg r
+SET
+    reorg_len = end_block.height - start_block.height + 1,
+    start_main_height = main_block.height
+FROM api_block start_block, api_block end_block, api_block main_block
+WHERE
+    start_block.hash = r.start_reorg_block_id AND
+    end_block.hash = r.end_reorg_block_id AND
+    main_block.hash = r.start_main_block_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_search_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reorg',
+            name='reorg_len',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='reorg',
+            name='start_main_height',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            FILL_REORG_LEN_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='reorg',
+            index=models.Index(fields=['blockchain', 'reorg_len', 'start_main_height'], name='reorg_len_start_main_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.3 on 2026-10-19 17:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_reorg_len'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('nr_blocks', models.PositiveIntegerField(default=0)),
+                ('nr_kernels', models.PositiveIntegerField(default=0)),
+                ('nr_inputs', models.PositiveIntegerField(default=0)),
+                ('nr_outputs', models.PositiveIntegerField(default=0)),
+                ('fees', models.BigIntegerField(default=0)),
+                ('total_difficulty', models.BigIntegerField(default=0)),
+                ('blockchain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='api.blockchain')),
+            ],
+            options={
+                'verbose_name_plural': 'daily stats',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailystats',
+            constraint=models.UniqueConstraint(fields=('blockchain', 'date'), name='unique_daily_stats_date'),
+        ),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:20
+
+from django.db import migrations, models
+
+
+# fill buckets of all resolutions from already stored main chain blocks, it's
+# the only backfill since 0005_daily_stats creates the table empty (rows left
+# by its earlier version are replaced)
+FILL_STATS_BUCKETS_SQL = """
+DELETE FROM api_statsbucket;
+INSERT INTO api_statsbucket (
+    blockchain_id, resolution, start, nr_blocks, nr_kernels, nr_inputs,
+    nr_outputs, nr_plain_kernels, nr_coinbase_kernels,
+    nr_height_locked_kernels, nr_no_recent_duplicate_kernels, fees,
+    total_difficulty, first_timestamp, last_timestamp
+)
+SELECT
+    b.blockchain_id,
+    r.resolution,
+    date_trunc(r.resolution, b.timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+    COUNT(*),
+    SUM(b.nr_kernels),
+    SUM(b.nr_inputs),
+    SUM(b.nr_outputs),
+    COALESCE(SUM(k.nr_plain_kernels), 0),
+    COALESCE(SUM(k.nr_coinbase_kernels), 0),
+    COALESCE(SUM(k.nr_height_locked_kernels), 0),
+    COALESCE(SUM(k.nr_no_recent_duplicate_kernels), 0),
+    COALESCE(SUM(k.fees), 0),
+    MAX(h.total_difficulty),
+    MIN(b.timestamp),
+    MAX(b.timestamp)
+FROM api_block b
+JOIN api_blockheader h ON h.id = b.header_id
+LEFT JOIN (
+    SELECT
+        block_id,
+        SUM(fee) AS fees,
+        COUNT(*) FILTER (WHERE features = 'Plain') AS nr_plain_kernels,
+        COUNT(*) FILTER (WHERE features = 'Coinbase') AS nr_coinbase_kernels,
+        COUNT(*) FILTER (WHERE features = 'HeightLocked') AS nr_height_locked_kernels,
+        COUNT(*) FILTER (WHERE features = 'NoRecentDuplicate') AS nr_no_recent_duplicate_kernels
+    FROM api_kernel
+    GROUP BY block_id
+) k ON k.block_id = b.hash
+CROSS JOIN (VALUES ('hour'), ('day'), ('week')) AS r(resolution)
+WHERE b.reorg_id IS NULL
+GROUP BY b.blockchain_id, r.resolution, 3;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_daily_stats'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='dailystats',
+            name='unique_daily_stats_date',
+        ),
+        migrations.RenameModel(
+            old_name='DailyStats',
+            new_name='StatsBucket',
+        ),
+        migrations.AlterModelOptions(
+            name='statsbucket',
+            options={},
+        ),
+        migrations.RenameField(
+            model_name='statsbucket',
+            old_name='date',
+            new_name='start',
+        ),
+        migrations.AlterField(
+            model_name='statsbucket',
+            name='start',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='statsbucket',
+            name='blockchain',
+            field=models.ForeignKey(on_delete=models.deletion.CASCADE, related_name='stats_buckets', to='api.blockchain'),
+        ),
+        migrations.AddField(
+            model_name='statsbucket',
+            name='resolution',
+            field=models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('week', 'Week')], default='day', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='statsbucket',
+            name='first_timestamp',
+            field=models.DateTimeField(default='2000-01-01T00:00:00+00:00'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='statsbucket',
+            name='last_timestamp',
+            field=models.DateTimeField(default='2000-01-01T00:00:00+00:00'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='statsbucket',
+            name='nr_coinbase_kernels',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='statsbucket',
+            name='nr_height_locked_kernels',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='statsbucket',
+            name='nr_no_recent_duplicate_kernels',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='statsbucket',
+            name='nr_plain_kernels',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='statsbucket',
+            constraint=models.UniqueConstraint(fields=('blockchain', 'resolution', 'start'), name='unique_stats_bucket_start'),
+        ),
+        migrations.RunSQL(
+            FILL_STATS_BUCKETS_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:05
+
+from django.db import migrations, models
+
+
+# fill fee summary and kernel feature counts of already stored blocks
+FILL_BLOCK_FEE_STATS_SQL = """
+UPDATE api_block b
+SET
+    fees = k.fees,
+    min_fee = k.min_fee,
+    max_fee = k.max_fee,
+    median_fee = k.median_fee,
+    nr_plain_kernels = k.nr_plain_kernels,
+    nr_coinbase_kernels = k.nr_coinbase_kernels,
+    nr_height_locked_kernels = k.nr_height_locked_kernels,
+    nr_no_recent_duplicate_kernels = k.nr_no_recent_duplicate_kernels
+FROM (
+    SELECT
+        block_id,
+        SUM(fee) AS fees,
+        MIN(fee) FILTER (WHERE features != 'Coinbase') AS min_fee,
+        MAX(fee) FILTER (WHERE features != 'Coinbase') AS max_fee,
+        percentile_disc(0.5) WITHIN GROUP (ORDER BY fee)
+            FILTER (WHERE features != 'Coinbase') AS median_fee,
+        COUNT(*) FILTER (WHERE features = 'Plain') AS nr_plain_kernels,
+        COUNT(*) FILTER (WHERE features = 'Coinbase') AS nr_coinbase_kernels,
+        COUNT(*) FILTER (WHERE features = 'HeightLocked') AS nr_height_locked_kernels,
+        COUNT(*) FILTER (WHERE features = 'NoRecentDuplicate') AS nr_no_recent_duplicate_kernels
+    FROM api_kernel
+    GROUP BY block_id
+) k
+WHERE k.block_id = b.hash;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_stats_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='fees',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='max_fee',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='median_fee',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='min_fee',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='nr_coinbase_kernels',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='nr_height_locked_kernels',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='nr_no_recent_duplicate_kernels',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='nr_plain_kernels',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            FILL_BLOCK_FEE_STATS_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:07
+
+from django.db import migrations, models
+
+
+# fill height of the last main chain block of existing buckets
+FILL_LAST_HEIGHT_SQL = """
+UPDATE api_statsbucket s
+SET last_height = (
+    SELECT MAX(b.height)
+    FROM api_block b
+    WHERE
+        b.blockchain_id = s.blockchain_id AND
+        b.reorg_id IS NULL AND
+        b.timestamp >= s.start AND
+        b.timestamp < s.start + ('1 ' || s.resolution)::interval
+);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_block_fee_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statsbucket',
+            name='last_height',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            FILL_LAST_HEIGHT_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
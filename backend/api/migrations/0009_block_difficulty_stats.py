@@ -0,0 +1,74 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:09
+
+from django.db import migrations, models
+
+
+# fill difficulty and block time of already stored blocks from their previous
+# blocks and hashrate of main chain blocks over the last 60 blocks
+FILL_BLOCK_DIFFICULTY_STATS_SQL = """
+UPDATE api_block b
+SET
+    difficulty = CASE
+        WHEN b.height = 0 THEN h.total_difficulty
+        ELSE h.total_difficulty - ph.total_difficulty
+    END,
+    block_time = EXTRACT(EPOCH FROM b.timestamp - p.timestamp)::integer
+FROM api_blockheader h, api_block p, api_blockheader ph
+WHERE
+    h.id = b.header_id AND
+    p.hash = b.prev_hash AND
+    ph.id = p.header_id;
+
+UPDATE api_block b
+SET difficulty = h.total_difficulty
+FROM api_blockheader h
+WHERE h.id = b.header_id AND b.height = 0;
+
+UPDATE api_block b
+SET hashrate = x.hashrate
+FROM (
+    SELECT
+        hash,
+        CASE
+            WHEN COUNT(block_time) OVER w = 60 AND SUM(block_time) OVER w > 0
+            THEN (SUM(difficulty) OVER w / SUM(block_time) OVER w)::double precision
+        END AS hashrate
+    FROM api_block
+    WHERE reorg_id IS NULL
+    WINDOW w AS (
+        PARTITION BY blockchain_id
+        ORDER BY height
+        ROWS BETWEEN 59 PRECEDING AND CURRENT ROW
+    )
+) x
+WHERE b.hash = x.hash AND x.hashrate IS NOT NULL;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_stats_bucket_last_height'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='block_time',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='difficulty',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='hashrate',
+            field=models.FloatField(null=True),
+        ),
+        migrations.RunSQL(
+            FILL_BLOCK_DIFFICULTY_STATS_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# fill UTXO set from main chain outputs which are not spent
+FILL_UNSPENT_OUTPUTS_SQL = """
+INSERT INTO api_unspentoutput (blockchain_id, commitment, output_id)
+SELECT b.blockchain_id, o.commitment, o.id
+FROM api_output o
+JOIN api_block b ON b.hash = o.block_id
+WHERE b.reorg_id IS NULL AND NOT o.spent
+ON CONFLICT DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_block_difficulty_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnspentOutput',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('commitment', models.CharField(max_length=66)),
+                ('blockchain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unspent_outputs', to='api.blockchain')),
+                ('output', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='unspent_output', to='api.output')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='unspentoutput',
+            constraint=models.UniqueConstraint(fields=('blockchain', 'commitment'), name='unique_unspent_output_commitment'),
+        ),
+        migrations.RunSQL(
+            FILL_UNSPENT_OUTPUTS_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
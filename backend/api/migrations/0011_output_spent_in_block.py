@@ -0,0 +1,42 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# fill main chain block which spends already stored outputs
+FILL_SPENT_IN_BLOCK_SQL = """
+UPDATE api_output o
+SET
+    spent_in_block_id = ib.hash,
+    spent_height = ib.height
+FROM api_input i, api_block ib
+WHERE
+    i.output_id = o.id AND
+    ib.hash = i.block_id AND
+    ib.reorg_id IS NULL;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_unspent_output'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='output',
+            name='spent_height',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='output',
+            name='spent_in_block',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='spent_outputs', to='api.block'),
+        ),
+        migrations.RunSQL(
+            FILL_SPENT_IN_BLOCK_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.3 on 2026-10-19 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_output_spent_in_block'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='block',
+            index=models.Index(fields=['blockchain', 'prev_hash'], name='block_prev_hash_idx'),
+        ),
+    ]
@@ -29,6 +29,24 @@ class DefaultMixin(object):
     permission_classes = []
 
 
+class DynamicFieldsViewMixin(object):
+    """
+    Passes comma separated 'fields' and 'exclude' query params to serializer's
+    context, eg. '?exclude=outputs.proof,outputs.merkle_proof'. They're used by
+    serializers which inherit from serializers.DynamicFieldsMixin.
+    """
+
+    def get_requested_fields(self, param):
+        value = self.request.query_params.get(param, '')
+        return set(name.strip() for name in value.split(',') if name.strip())
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields('fields')
+        context['exclude'] = self.get_requested_fields('exclude')
+        return context
+
+
 class CustomModelViewSet(
     DefaultMixin,
     viewsets.ModelViewSet
@@ -36,3 +54,10 @@ class CustomModelViewSet(
     """Default viewset for models."""
     pass
 
+
+class CustomReadOnlyModelViewSet(
+    DefaultMixin,
+    viewsets.ReadOnlyModelViewSet
+):
+    """Default read-only viewset for models."""
+    pass
@@ -1,5 +1,3 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
@@ -172,18 +170,11 @@ class Blockchain(TimeStampedModel):
         old_instance = Blockchain.objects.get(pk=self.pk) if self.pk else None
         res = super().save(*args, **kwargs)
         if old_instance and self.load_progress != old_instance.load_progress:
-            # load progress changed, send info
-            async_to_sync(get_channel_layer().group_send)(
-                'admin_group',
-                {
-                    'type': 'blockchain_progress_changed',
-                    'message': {
-                        'slug': self.slug,
-                        # convert to float since Decimal is not serializable
-                        'load_progress': float(self.load_progress),
-                    },
-                }
-            )
+            # load progress changed, admins get the latest value with the
+            # next coalesced broadcast
+            # import here to avoid cyclic import
+            from .helpers import queue_progress_broadcast
+            queue_progress_broadcast(self.slug, self.load_progress)
         return res
 
     def full_print(self):
@@ -207,6 +198,7 @@ class Blockchain(TimeStampedModel):
         Output.objects.filter(block__blockchain=self).delete()
         Kernel.objects.filter(block__blockchain=self).delete()
         self.reorgs.all().delete()
+        self.stats_buckets.all().delete()
 
         content_type = ContentType.objects.get_for_model(self)
         DramatiqTask.objects.filter(
@@ -264,11 +256,38 @@ class Block(TimeStampedModel):
     nr_inputs = models.PositiveIntegerField(default=0)
     nr_outputs = models.PositiveIntegerField(default=0)
     nr_kernels = models.PositiveIntegerField(default=0)
+    # number of kernels by their features
+    nr_plain_kernels = models.PositiveIntegerField(default=0)
+    nr_coinbase_kernels = models.PositiveIntegerField(default=0)
+    nr_height_locked_kernels = models.PositiveIntegerField(default=0)
+    nr_no_recent_duplicate_kernels = models.PositiveIntegerField(default=0)
+    # sum of kernel fees and the lowest, highest and (lower) median fee of
+    # non-coinbase kernels, they're null when the block has no transactions
+    fees = models.BigIntegerField(default=0)
+    min_fee = models.BigIntegerField(null=True)
+    max_fee = models.BigIntegerField(null=True)
+    median_fee = models.BigIntegerField(null=True)
+    # difficulty of this block (total difficulty delta to the previous block),
+    # seconds since the previous block and estimated hashrate as difficulty
+    # per second over the last HASHRATE_WINDOW main chain blocks. They're
+    # null until the needed previous blocks are stored.
+    difficulty = models.BigIntegerField(null=True)
+    block_time = models.IntegerField(null=True)
+    hashrate = models.FloatField(null=True)
     # when reorg is set it means this block is part of a reorg and not the main
     # chain
     reorg = models.ForeignKey(
         'Reorg', null=True, related_name='blocks', on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # used to follow the chain forward when fixing reorgs
+            models.Index(
+                fields=['blockchain', 'prev_hash'],
+                name='block_prev_hash_idx',
+            ),
+        ]
+
     def __str__(self):
         suffix = ''
         if self.reorg:
@@ -321,15 +340,21 @@ class Output(TimeStampedModel):
         choices=OUTPUT_TYPE
     )
 
-    # pedersen commitment as hex
-    commitment = models.CharField(
-        max_length=66,
-        db_index=True,
-    )
+    # pedersen commitment as hex, indexed together with block
+    commitment = models.CharField(max_length=66)
 
     # on reorged blocks 'spent' is set based on the reorged chain, not main
     spent = models.BooleanField()
 
+    # main chain block, and its height, with the input which spends this output
+    spent_in_block = models.ForeignKey(
+        Block,
+        null=True,
+        related_name='spent_outputs',
+        on_delete=models.SET_NULL,
+    )
+    spent_height = models.PositiveIntegerField(null=True)
+
     # range proof as hex
     proof = models.TextField()
 
@@ -341,6 +366,15 @@ class Output(TimeStampedModel):
 
     mmr_index = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            # covers commitment search, which only needs the block
+            models.Index(
+                fields=['commitment', 'block'],
+                name='output_commitment_block_idx',
+            ),
+        ]
+
     def __str__(self):
         return (
             f'{self.commitment}({self.id}), spent: {self.spent}, '
@@ -394,14 +428,85 @@ class Kernel(TimeStampedModel):
 
     lock_height = models.IntegerField()
 
-    excess = models.CharField(max_length=66, db_index=True)
+    # indexed together with block
+    excess = models.CharField(max_length=66)
 
     excess_sig = models.CharField(max_length=142)
 
+    class Meta:
+        indexes = [
+            # covers excess search, which only needs the block
+            models.Index(
+                fields=['excess', 'block'],
+                name='kernel_excess_block_idx',
+            ),
+        ]
+
     def __str__(self):
         return f'{self.excess}'
 
 
+class UnspentOutput(models.Model):
+    """
+    UTXO set of the main chain, it holds main chain outputs which are not spent.
+    It's updated when blocks are stored and when reorgs are fixed, and it can
+    be rebuilt from outputs at any time.
+    """
+    id = models.BigAutoField(primary_key=True)
+    blockchain = models.ForeignKey(
+        Blockchain, related_name='unspent_outputs', on_delete=models.CASCADE)
+    commitment = models.CharField(max_length=66)
+    output = models.OneToOneField(
+        Output, related_name='unspent_output', on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['blockchain', 'commitment'],
+                name='unique_unspent_output_commitment',
+            ),
+        ]
+
+    def __str__(self):
+        return self.commitment
+
+
+class SearchEntry(models.Model):
+    """
+    Search index which maps block hashes, kernel excesses and output
+    commitments to blocks they're in, so that every hash-like search (also by
+    prefix) is a single index probe. Entries are created when blocks are stored.
+    """
+
+    class Type(models.TextChoices):
+        BLOCK = 'block', 'Block'
+        KERNEL = 'kernel', 'Kernel'
+        OUTPUT = 'output', 'Output'
+
+    id = models.BigAutoField(primary_key=True)
+    blockchain = models.ForeignKey(
+        Blockchain, related_name='search_entries', on_delete=models.CASCADE)
+    # block hash, kernel excess or output commitment
+    term = models.CharField(max_length=66)
+    type = models.CharField(max_length=255, choices=Type.choices)
+    block = models.ForeignKey(
+        Block, related_name='search_entries', on_delete=models.CASCADE)
+    height = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            # varchar_pattern_ops makes the index usable for prefix search
+            models.Index(
+                fields=['blockchain', 'term'],
+                name='search_entry_term_idx',
+                opclasses=['int8_ops', 'varchar_pattern_ops'],
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.type}: {self.term}'
+
+
 class Reorg(TimeStampedModel):
     id = models.BigAutoField(primary_key=True)
     blockchain = models.ForeignKey(
@@ -419,11 +524,80 @@ class Reorg(TimeStampedModel):
     # incrementally in the order they're accepted).
     start_main_block = models.ForeignKey(
         Block, related_name='start_mains', on_delete=models.CASCADE)
+    # number of reorged blocks and height of start_main_block, both are set on
+    # creation so that reorgs can be searched without joining blocks
+    reorg_len = models.PositiveIntegerField()
+    start_main_height = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['blockchain', 'reorg_len', 'start_main_height'],
+                name='reorg_len_start_main_idx',
+            ),
+        ]
 
     def __str__(self):
         return '{}: start: {}, end: {}'.format(
             self.blockchain.slug, self.start_reorg_block, self.end_reorg_block)
 
+    def save(self, *args, **kwargs):
+        if not self.pk:
+            self.reorg_len = \
+                self.end_reorg_block.height - self.start_reorg_block.height + 1
+            self.start_main_height = self.start_main_block.height
+        return super().save(*args, **kwargs)
+
+
+class StatsBucket(models.Model):
+    """
+    Rollup of main chain blocks in an hour, day or week. It's updated
+    incrementally when blocks are stored and recomputed for the affected
+    buckets when a reorg happens.
+    """
+
+    class Resolution(models.TextChoices):
+        HOUR = 'hour', 'Hour'
+        DAY = 'day', 'Day'
+        WEEK = 'week', 'Week'
+
+    id = models.BigAutoField(primary_key=True)
+    blockchain = models.ForeignKey(
+        Blockchain, related_name='stats_buckets', on_delete=models.CASCADE)
+    resolution = models.CharField(max_length=255, choices=Resolution.choices)
+    # UTC start of the bucket, weeks start on monday
+    start = models.DateTimeField()
+    nr_blocks = models.PositiveIntegerField(default=0)
+    nr_kernels = models.PositiveIntegerField(default=0)
+    nr_inputs = models.PositiveIntegerField(default=0)
+    nr_outputs = models.PositiveIntegerField(default=0)
+    # number of kernels by their features
+    nr_plain_kernels = models.PositiveIntegerField(default=0)
+    nr_coinbase_kernels = models.PositiveIntegerField(default=0)
+    nr_height_locked_kernels = models.PositiveIntegerField(default=0)
+    nr_no_recent_duplicate_kernels = models.PositiveIntegerField(default=0)
+    # sum of kernel fees
+    fees = models.BigIntegerField(default=0)
+    # total difficulty of the last block in the bucket
+    total_difficulty = models.BigIntegerField(default=0)
+    # timestamps of the first and the last block in the bucket
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    # height of the last block in the bucket, supply at the end of the bucket
+    # is derived from it
+    last_height = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['blockchain', 'resolution', 'start'],
+                name='unique_stats_bucket_start',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.blockchain.slug}: {self.resolution} {self.start}'
+
 
 class DramatiqTask(TimeStampedModel):
     """We store task's message_id so that we can abort the task."""
@@ -452,18 +626,17 @@ class DramatiqTask(TimeStampedModel):
     content_object = GenericForeignKey('content_type', 'object_id')
 
     def save(self, *args, **kwargs):
+        from .helpers import send_websocket_message
         from .serializers import DramatiqTaskSerializer
         old_instance = DramatiqTask.objects.get(pk=self.pk) if self.pk else None
         res = super().save(*args, **kwargs)
         if old_instance and self.status != old_instance.status:
             # status changed, send info
             print('sending task status update')
-            async_to_sync(get_channel_layer().group_send)(
+            send_websocket_message(
                 'admin_group',
-                {
-                    'type': 'task_status_changed',
-                    'message': DramatiqTaskSerializer(self).data,
-                }
+                'task_status_changed',
+                DramatiqTaskSerializer(self).data,
             )
         return res
 
@@ -41,7 +41,6 @@ class NodeV2API:
         self.foreign_api_user = node.api_username
         self.foreign_api_password = node.api_password
         self._cached_blocks = {}
-        
 
     def post(self, method, params):
         payload = {
@@ -89,7 +88,18 @@ class NodeV2API:
 
     def get_header(self, height=None, hash=None, commit=None):
         resp = self.post('get_header', [height, hash, commit])
-        return resp["result"]["Ok"]
+        try:
+            return resp["result"]["Ok"]
+        except KeyError:
+            if 'Err' in resp['result'] and resp['result']['Err'] == 'NotFound':
+                logger.warning(
+                    'NodeBlockNotFoundException',
+                    extra={ 'height': height, 'hash': hash },
+                )
+                raise NodeBlockNotFoundException()
+            log_data = json.dumps(resp)
+            logger.error('NodeUnknownException', extra={ 'result': log_data })
+            raise NodeUnknownException()
 
     def get_block(self, height=None, hash=None, commit=None):
         resp = self.post('get_block', [height, hash, commit])
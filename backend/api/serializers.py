@@ -1,5 +1,6 @@
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import (
     Blockchain,
@@ -14,6 +15,52 @@ from .models import (
     DramatiqTask,
 )
 from .node import NodeV2API
+from .stats import get_supply
+
+
+class DynamicFieldsMixin:
+    """
+    Limits serialized fields to those requested through 'fields' and 'exclude'
+    sets in the serializer's context. Nested fields are referenced with a dot,
+    eg. 'outputs.proof' refers to field 'proof' of the nested 'outputs'.
+    Serializers which are not bound to a parent can set their path through
+    'field_path' argument.
+    """
+
+    def __init__(self, *args, field_path=None, **kwargs):
+        self._field_path = field_path
+        super().__init__(*args, **kwargs)
+
+    def get_field_path(self):
+        if self._field_path is not None:
+            return self._field_path
+        path = []
+        node = self
+        while node.parent is not None:
+            # list serializers' children have no field name
+            if node.field_name:
+                path.insert(0, node.field_name)
+            node = node.parent
+        return '.'.join(path)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        path = self.get_field_path()
+        prefix = f'{path}.' if path else ''
+        requested = [
+            name[len(prefix):]
+            for name in self.context.get('fields', set())
+            if name.startswith(prefix)
+        ]
+        if requested:
+            # 'outputs.commitment' implies that 'outputs' is requested too
+            keep = set(name.split('.')[0] for name in requested)
+            for name in set(fields) - keep:
+                fields.pop(name)
+        for name in self.context.get('exclude', set()):
+            if name.startswith(prefix) and '.' not in name[len(prefix):]:
+                fields.pop(name[len(prefix):], None)
+        return fields
 
 
 class DramatiqTaskSimpleSerializer(serializers.ModelSerializer):
@@ -103,6 +150,7 @@ class BlockSerializer(serializers.ModelSerializer):
     blockchain = BlockchainSerializer()
     header = BlockHeaderSerializer()
     starting_reorg_blocks = serializers.SerializerMethodField()
+    supply = serializers.SerializerMethodField()
 
     class Meta:
         model = Block
@@ -116,28 +164,50 @@ class BlockSerializer(serializers.ModelSerializer):
             'nr_kernels',
             'nr_inputs',
             'nr_outputs',
+            'fees',
+            'min_fee',
+            'max_fee',
+            'median_fee',
+            'difficulty',
+            'block_time',
+            'hashrate',
+            'supply',
             'blockchain',
             'starting_reorg_blocks',
         )
 
+    def get_supply(self, block):
+        return get_supply(block.height)
+
     def get_starting_reorg_blocks(self, block):
-        reorgs = Reorg.objects.filter(start_main_block=block)
-        reorgs = list(filter(
-            lambda reorg: reorg.end_reorg_block.height - \
-                    reorg.start_reorg_block.height + 1 >= settings.MIN_REORG_LEN,
-            reorgs
-        ))
+        reorgs = Reorg.objects\
+            .filter(
+                start_main_block=block,
+                reorg_len__gte=settings.MIN_REORG_LEN,
+            )\
+            .select_related('start_reorg_block')
         return BlockSerializer(
             [reorg.start_reorg_block for reorg in reorgs], many=True).data
 
 
-class KernelSerializer(serializers.ModelSerializer):
+class KernelSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Kernel
         fields = '__all__'
 
 
-class InputSerializer(serializers.ModelSerializer):
+def get_created_in_outputs():
+    """
+    Returns queryset of outputs with only the fields which InputSerializer's
+    created_in needs, it's used to prefetch inputs' outputs without their
+    proofs.
+    """
+    return Output.objects\
+        .select_related('block')\
+        .only('id', 'block__height', 'block__hash')
+
+
+class InputSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     created_in = serializers.SerializerMethodField()
 
     class Meta:
@@ -151,26 +221,20 @@ class InputSerializer(serializers.ModelSerializer):
         return (output.block.height, output.block.hash)
 
 
-class OutputSerializer(serializers.ModelSerializer):
+class OutputSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     spent_in = serializers.SerializerMethodField()
 
     class Meta:
         model = Output
-        fields = '__all__'
+        exclude = ('spent_in_block', 'spent_height')
 
     def get_spent_in(self, output):
-        try:
-            # we use .all and then manually filter so that prefetched data gets used
-            input = list(filter(
-                lambda input: input.block.reorg is None,
-                output.inputs.all())
-            )[0]
-        except IndexError:
+        if output.spent_in_block_id is None:
             return None
-        return (input.block.height, input.block.hash)
+        return (output.spent_height, output.spent_in_block_id)
 
 
-class BlockDetailSerializer(serializers.ModelSerializer):
+class BlockDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     header = BlockHeaderSerializer()
     kernels = KernelSerializer(many=True)
     inputs = InputSerializer(many=True)
@@ -179,6 +243,7 @@ class BlockDetailSerializer(serializers.ModelSerializer):
     confirmations = serializers.SerializerMethodField()
     next_hash = serializers.SerializerMethodField()
     next_block_reorgs = serializers.SerializerMethodField()
+    supply = serializers.SerializerMethodField()
 
     class Meta:
         model = Block
@@ -191,6 +256,18 @@ class BlockDetailSerializer(serializers.ModelSerializer):
             'kernels',
             'inputs',
             'outputs',
+            'fees',
+            'min_fee',
+            'max_fee',
+            'median_fee',
+            'nr_plain_kernels',
+            'nr_coinbase_kernels',
+            'nr_height_locked_kernels',
+            'nr_no_recent_duplicate_kernels',
+            'difficulty',
+            'block_time',
+            'hashrate',
+            'supply',
             'blockchain',
             'confirmations',
             'next_hash',
@@ -198,6 +275,9 @@ class BlockDetailSerializer(serializers.ModelSerializer):
             'next_block_reorgs',
         )
 
+    def get_supply(self, block):
+        return get_supply(block.height)
+
     def get_confirmations(self, block):
         # in reorged blocks we show confirmations based on the reorged chain!
         tip_height = block.blockchain.blocks\
@@ -218,15 +298,84 @@ class BlockDetailSerializer(serializers.ModelSerializer):
 
     def get_next_block_reorgs(self, block):
         from .serializers import ReorgSerializer
-        reorgs = Reorg.objects.filter(start_main_block__prev_hash=block.hash)
-        reorgs = list(filter(
-            lambda reorg: reorg.end_reorg_block.height - \
-                    reorg.start_reorg_block.height + 1 >= settings.MIN_REORG_LEN,
-            reorgs
-        ))
+        reorgs = Reorg.objects\
+            .filter(
+                start_main_block__prev_hash=block.hash,
+                reorg_len__gte=settings.MIN_REORG_LEN,
+            )\
+            .select_related('blockchain', 'start_reorg_block')
         return ReorgSerializer(reorgs, many=True).data
 
 
+class BlockExportSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    header = BlockHeaderSerializer()
+    kernels = KernelSerializer(many=True)
+    inputs = InputSerializer(many=True)
+    outputs = OutputSerializer(many=True)
+
+    class Meta:
+        model = Block
+        fields = (
+            'hash',
+            'height',
+            'timestamp',
+            'header',
+            'prev_hash',
+            'nr_kernels',
+            'nr_inputs',
+            'nr_outputs',
+            'kernels',
+            'inputs',
+            'outputs',
+        )
+
+
+class BlockSummarySerializer(BlockDetailSerializer):
+    """
+    Same as BlockDetailSerializer but instead of all inputs, outputs and
+    kernels it includes only their first page. The rest can be fetched through
+    the block's nested inputs/outputs/kernels endpoints.
+    """
+    kernels = serializers.SerializerMethodField()
+    inputs = serializers.SerializerMethodField()
+    outputs = serializers.SerializerMethodField()
+
+    class Meta(BlockDetailSerializer.Meta):
+        fields = BlockDetailSerializer.Meta.fields + (
+            'nr_kernels',
+            'nr_inputs',
+            'nr_outputs',
+        )
+
+    def _get_first_page(self, queryset, serializer_class, field_path):
+        page_size = self.context['page_size']
+        return serializer_class(
+            queryset.order_by('id')[:page_size],
+            many=True,
+            context=self.context,
+            field_path=field_path,
+        ).data
+
+    def get_kernels(self, block):
+        return self._get_first_page(
+            block.kernels.all(), KernelSerializer, 'kernels')
+
+    def get_inputs(self, block):
+        return self._get_first_page(
+            block.inputs.prefetch_related(
+                Prefetch('output', queryset=get_created_in_outputs())),
+            InputSerializer,
+            'inputs',
+        )
+
+    def get_outputs(self, block):
+        return self._get_first_page(
+            block.outputs.all(),
+            OutputSerializer,
+            'outputs',
+        )
+
+
 class ReorgSerializer(serializers.ModelSerializer):
     blockchain = BlockchainSerializer()
     start_reorg_block = BlockSerializer()
@@ -1,7 +1,11 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from backend.api.models import Block, Reorg
-from backend.api.helpers import fix_outputs_and_inputs_from_reorg
+from backend.api.helpers import (
+    fix_outputs_and_inputs_from_reorg,
+    reassign_reorg_blocks,
+)
+from backend.api.stats import update_block_difficulty_stats, update_stats
 
 import logging
 
@@ -38,7 +42,7 @@ def on_reorg_create_fix_state(sender, instance, created, **kwargs):
             extra={
                 'pk': instance.pk,
                 'blockchain': instance.blockchain.slug,
-                'length': instance.end_reorg_block.height - instance.start_reorg_block.height + 1,
+                'length': instance.reorg_len,
                 'start_reorg_block.height': instance.start_reorg_block.height,
                 'start_reorg_block.hash': instance.start_reorg_block.hash,
                 'end_reorg_block.height': instance.end_reorg_block.height,
@@ -47,24 +51,19 @@ def on_reorg_create_fix_state(sender, instance, created, **kwargs):
                 'start_main_block.hash': instance.start_main_block.hash,
             },
         )
-        # add relation to Reorg instance for reorged blocks
-        cur_block = instance.start_reorg_block
-        while cur_block and cur_block.height <= instance.end_reorg_block.height:
-            cur_block.reorg = instance
-            cur_block.save()
-            cur_block = cur_block.get_next_block()
-        # make sure new main chain has no Reorg instances related to it
-        cur_block = instance.start_main_block
-        while cur_block:
-            if cur_block.reorg is not None:
-                reorg = cur_block.reorg
-                # this block is not reorged anymore!
-                cur_block.reorg = None
-                cur_block.save()
-                if not Block.objects.filter(reorg=reorg).exists():
-                    # reorg is empty, we don't need it anymore
-                    reorg.delete()
-            cur_block = cur_block.get_next_block()
+        # move blocks from and to the main chain
+        moved_blocks = reassign_reorg_blocks(instance)
+        affected_heights = {height for height, _ in moved_blocks}
+        affected_timestamps = {timestamp for _, timestamp in moved_blocks}
         # fix 'spent' for outputs and 'output' for inputs
-        fix_outputs_and_inputs_from_reorg(instance)
+        fix_outputs_and_inputs_from_reorg(
+            instance, end_height=max(affected_heights, default=None))
+        update_stats(instance.blockchain, affected_timestamps)
+        if affected_heights:
+            # hashrate windows of the main chain changed
+            update_block_difficulty_stats(
+                instance.blockchain,
+                min(affected_heights),
+                max(affected_heights),
+            )
 
@@ -0,0 +1,255 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import Greatest, Least, Trunc
+from .models import Block, StatsBucket
+
+import pytz
+
+
+# block and stats bucket field for each kernel feature
+KERNEL_FEATURE_FIELDS = {
+    'Plain': 'nr_plain_kernels',
+    'Coinbase': 'nr_coinbase_kernels',
+    'HeightLocked': 'nr_height_locked_kernels',
+    'NoRecentDuplicate': 'nr_no_recent_duplicate_kernels',
+}
+
+# block fields which are summed in stats buckets
+SUMMED_FIELDS = [
+    'nr_kernels',
+    'nr_inputs',
+    'nr_outputs',
+    'fees',
+    *KERNEL_FEATURE_FIELDS.values(),
+]
+
+# difficulty and block time of blocks with heights in the given range,
+# computed from their previous blocks
+BLOCK_DIFFICULTY_SQL = """
+UPDATE api_block b
+SET
+    difficulty = x.difficulty,
+    block_time = x.block_time
+FROM (
+    SELECT
+        c.hash,
+        CASE
+            WHEN c.height = 0 THEN h.total_difficulty
+            ELSE h.total_difficulty - ph.total_difficulty
+        END AS difficulty,
+        EXTRACT(EPOCH FROM c.timestamp - p.timestamp)::integer AS block_time
+    FROM api_block c
+    JOIN api_blockheader h ON h.id = c.header_id
+    LEFT JOIN api_block p ON p.hash = c.prev_hash
+    LEFT JOIN api_blockheader ph ON ph.id = p.header_id
+    WHERE
+        c.blockchain_id = %(blockchain_id)s AND
+        c.height BETWEEN %(start_height)s AND %(end_height)s AND
+        (c.height = 0 OR p.hash IS NOT NULL)
+) x
+WHERE
+    b.hash = x.hash AND
+    (
+        b.difficulty IS DISTINCT FROM x.difficulty OR
+        b.block_time IS DISTINCT FROM x.block_time
+    );
+"""
+
+# hashrate of main chain blocks with heights in the given range, it's only set
+# when all blocks in the window have a known difficulty and block time
+BLOCK_HASHRATE_SQL = """
+UPDATE api_block b
+SET hashrate = x.hashrate
+FROM (
+    SELECT
+        hash,
+        height,
+        CASE
+            WHEN COUNT(block_time) OVER w = %(window)s AND SUM(block_time) OVER w > 0
+            THEN (SUM(difficulty) OVER w / SUM(block_time) OVER w)::double precision
+        END AS hashrate
+    FROM api_block
+    WHERE
+        blockchain_id = %(blockchain_id)s AND
+        reorg_id IS NULL AND
+        height BETWEEN %(start_height)s - %(window)s + 1 AND %(end_height)s
+    WINDOW w AS (ORDER BY height ROWS BETWEEN %(window)s - 1 PRECEDING AND CURRENT ROW)
+) x
+WHERE
+    b.hash = x.hash AND
+    x.height >= %(start_height)s AND
+    b.hashrate IS DISTINCT FROM x.hashrate;
+"""
+
+BUCKET_LENGTHS = {
+    StatsBucket.Resolution.HOUR: timedelta(hours=1),
+    StatsBucket.Resolution.DAY: timedelta(days=1),
+    StatsBucket.Resolution.WEEK: timedelta(weeks=1),
+}
+
+
+def get_bucket_start(timestamp, resolution):
+    """Returns UTC start of the bucket which contains the given timestamp."""
+    start = timestamp\
+        .astimezone(pytz.utc)\
+        .replace(minute=0, second=0, microsecond=0)
+    if resolution != StatsBucket.Resolution.HOUR:
+        start = start.replace(hour=0)
+    if resolution == StatsBucket.Resolution.WEEK:
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def get_supply(height):
+    """
+    Returns circulating supply in nanogrin after the block at the given height.
+    Every block, including genesis, emits the same reward so it doesn't
+    depend on which blocks are on the main chain.
+    """
+    return (height + 1) * settings.BLOCK_REWARD
+
+
+def get_kernel_stats(kernels_data):
+    """
+    Returns fee summary and kernel feature counts of a block from the kernels
+    data returned by the node. The result matches Block's fields.
+    """
+    res = {field: 0 for field in KERNEL_FEATURE_FIELDS.values()}
+    for kernel_data in kernels_data:
+        field = KERNEL_FEATURE_FIELDS.get(kernel_data['features'])
+        if field:
+            res[field] += 1
+    res['fees'] = sum(kernel_data['fee'] for kernel_data in kernels_data)
+    # coinbase kernels have no fee so they're not part of the fee market
+    tx_fees = sorted(
+        kernel_data['fee']
+        for kernel_data in kernels_data
+        if kernel_data['features'] != 'Coinbase'
+    )
+    res['min_fee'] = tx_fees[0] if tx_fees else None
+    res['max_fee'] = tx_fees[-1] if tx_fees else None
+    res['median_fee'] = tx_fees[(len(tx_fees) - 1) // 2] if tx_fees else None
+    return res
+
+
+def update_block_difficulty_stats(blockchain, start_height, end_height):
+    """
+    Fills difficulty and block time of blocks with heights in the given range
+    and hashrate of main chain blocks whose window includes any of them. It
+    only touches rows whose values changed.
+    """
+    params = {
+        'blockchain_id': blockchain.id,
+        'start_height': start_height,
+        'end_height': end_height,
+        'window': settings.HASHRATE_WINDOW,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(BLOCK_DIFFICULTY_SQL, params)
+        params['end_height'] = end_height + settings.HASHRATE_WINDOW - 1
+        cursor.execute(BLOCK_HASHRATE_SQL, params)
+
+
+def add_block_to_stats(block):
+    """Adds newly stored main chain block to the buckets of all resolutions."""
+    total_difficulty = block.header.total_difficulty
+    for resolution in StatsBucket.Resolution.values:
+        start = get_bucket_start(block.timestamp, resolution)
+        updated = StatsBucket.objects\
+            .filter(
+                blockchain=block.blockchain,
+                resolution=resolution,
+                start=start,
+            )\
+            .update(
+                nr_blocks=F('nr_blocks') + 1,
+                total_difficulty=Greatest('total_difficulty', total_difficulty),
+                first_timestamp=Least('first_timestamp', block.timestamp),
+                last_timestamp=Greatest('last_timestamp', block.timestamp),
+                last_height=Greatest('last_height', block.height),
+                **{
+                    field: F(field) + getattr(block, field)
+                    for field in SUMMED_FIELDS
+                },
+            )
+        if not updated:
+            StatsBucket.objects.create(
+                blockchain=block.blockchain,
+                resolution=resolution,
+                start=start,
+                nr_blocks=1,
+                total_difficulty=total_difficulty,
+                first_timestamp=block.timestamp,
+                last_timestamp=block.timestamp,
+                last_height=block.height,
+                **{field: getattr(block, field) for field in SUMMED_FIELDS},
+            )
+
+
+def _update_resolution_stats(blockchain, resolution, starts):
+    main_blocks = Block.objects.filter(
+        blockchain=blockchain,
+        reorg=None,
+        timestamp__gte=min(starts),
+        timestamp__lt=max(starts) + BUCKET_LENGTHS[resolution],
+    )
+    buckets_data = main_blocks\
+        .annotate(start=Trunc('timestamp', resolution, tzinfo=pytz.utc))\
+        .values('start')\
+        .annotate(
+            nr_blocks=Count('hash'),
+            total_difficulty=Max('header__total_difficulty'),
+            first_timestamp=Min('timestamp'),
+            last_timestamp=Max('timestamp'),
+            last_height=Max('height'),
+            **{field: Sum(field) for field in SUMMED_FIELDS},
+        )
+    blocks_data = {x['start']: x for x in buckets_data}
+    for start in starts:
+        if start not in blocks_data:
+            StatsBucket.objects\
+                .filter(
+                    blockchain=blockchain,
+                    resolution=resolution,
+                    start=start,
+                )\
+                .delete()
+            continue
+        defaults = blocks_data[start]
+        del defaults['start']
+        StatsBucket.objects.update_or_create(
+            blockchain=blockchain,
+            resolution=resolution,
+            start=start,
+            defaults=defaults,
+        )
+
+
+def update_stats(blockchain, timestamps):
+    """
+    Recomputes buckets containing the given timestamps from the main chain
+    blocks, it's used when blocks were moved to or from a reorg.
+    """
+    if not timestamps:
+        return
+    for resolution in StatsBucket.Resolution.values:
+        starts = {
+            get_bucket_start(timestamp, resolution)
+            for timestamp in timestamps
+        }
+        _update_resolution_stats(blockchain, resolution, starts)
+
+
+def get_nr_main_blocks(blockchain):
+    """
+    Returns the number of stored main chain blocks, it's summed from the week
+    buckets so it doesn't have to count the blocks.
+    """
+    return StatsBucket.objects\
+        .filter(
+            blockchain=blockchain,
+            resolution=StatsBucket.Resolution.WEEK,
+        )\
+        .aggregate(nr_blocks=Sum('nr_blocks'))['nr_blocks'] or 0
@@ -1,14 +1,26 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from django.conf import settings
 from dramatiq import get_broker
 from dramatiq_abort import Abortable, backends
-from .bootstrap import update_blockchain_progress
+from redis.exceptions import LockNotOwnedError
+from .bootstrap import (
+    render_blockchain_snapshot,
+    store_queued_accepted_blocks,
+    update_blockchain_progress,
+)
 from .exceptions import UpdateBlockchainProgressError
 from .graphs import get_transaction_graph_data
 from .models import Blockchain
 from .helpers import (
+    delete_blockchain_snapshot,
+    get_blockchain_group_name,
+    get_broken_links,
     get_func_from_dotted_path,
+    get_ingestion_lock,
+    has_accepted_heights,
+    pop_pending_broadcast,
+    release_ingestion_lock,
+    repair_broken_links,
+    send_websocket_message,
     store_data_in_redis,
     load_data_from_redis,
 )
@@ -37,6 +49,42 @@ def bootstrap_blockchain(blockchain_slug):
     Blockchain.objects.get(slug=blockchain_slug).bootstrap()
 
 
+@dramatiq.actor(max_retries=3, time_limit=float("inf"))
+def ingest_accepted_blocks(blockchain_slug):
+    """
+    Stores queued accepted blocks of the given blockchain in batches by
+    ascending height. Only the holder of the blockchain's ingestion lock does
+    the work, the others exit since their heights are taken from the same
+    queue (bootstrap stores them between its own blocks while it runs).
+    Heights which failed to be stored stay queued and the task is retried.
+    """
+    lock = get_ingestion_lock(blockchain_slug)
+    while True:
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            blockchain = Blockchain.objects.filter(slug=blockchain_slug).first()
+            if not blockchain:
+                redis.delete(
+                    settings.ACCEPTED_BLOCKS_REDIS_KEY.format(blockchain_slug))
+                return
+            store_queued_accepted_blocks(blockchain, lock)
+        except LockNotOwnedError:
+            # the lock expired and another writer took it, the writer stores
+            # the queued heights
+            logger.warning(
+                'Ingestion lock lost, accepted blocks ingestion aborted',
+                extra={'blockchain': blockchain_slug},
+            )
+            return
+        finally:
+            release_ingestion_lock(lock)
+        # a height might have been queued after the queue was emptied but
+        # before the lock was released
+        if not has_accepted_heights(blockchain_slug):
+            return
+
+
 @dramatiq.actor(max_retries=0)
 def update_blockchains_progress_task():
     for blockchain in Blockchain.objects.all():
@@ -75,28 +123,75 @@ def update_price_task():
     # that data from somewhere
     store_data_in_redis(settings.REDIS_PRICE_KEY, price_datas)
     # send info through websocket
-    async_to_sync(get_channel_layer().group_send)(
+    send_websocket_message(
         'default_group',
-        {
-            'type': 'price_update',
-            'message': price_datas,
-        }
+        'price_update',
+        price_datas,
     )
 
 
+@dramatiq.actor(max_retries=0)
+def flush_broadcasts(blockchain_slug):
+    """
+    Sends websocket events of the blockchain which were queued during the
+    last interval, new blocks in one message and only the latest progress.
+    """
+    pending = pop_pending_broadcast(blockchain_slug)
+    if not pending:
+        return
+    # refresh the snapshot first so that clients which subscribe from now on
+    # don't miss these events
+    blockchain = Blockchain.objects.filter(slug=blockchain_slug).first()
+    if blockchain:
+        render_blockchain_snapshot(blockchain)
+    if 'load_progress' in pending:
+        send_websocket_message(
+            'admin_group',
+            'blockchain_progress_changed',
+            {
+                'slug': blockchain_slug,
+                'load_progress': pending['load_progress'],
+            },
+        )
+    group = get_blockchain_group_name(blockchain_slug)
+    if group is None:
+        # nobody can subscribe to the slug's group, the events are dropped
+        logger.warning(
+            'Invalid blockchain group name, blocks broadcast skipped',
+            extra={'blockchain': blockchain_slug},
+        )
+        return
+    if pending.get('reorged'):
+        # clients reload their blocks so there's no need to send them
+        send_websocket_message(
+            group,
+            'reorged',
+            blockchain_slug,
+        )
+    elif pending.get('blocks'):
+        send_websocket_message(
+            group,
+            'new_blocks',
+            {
+                'blockchain': blockchain_slug,
+                'nr_blocks': pending['nr_blocks'],
+                'blocks': pending['blocks'],
+            },
+        )
+
+
 @dramatiq.actor(max_retries=0, time_limit=float("inf"))
 def delete_blockchain(blockchain_slug):
     # import here to avoid cyclic import
     from .models import Blockchain
     Blockchain.objects.get(slug=blockchain_slug).delete()
-    async_to_sync(get_channel_layer().group_send)(
+    delete_blockchain_snapshot(blockchain_slug)
+    send_websocket_message(
         'admin_group',
+        'blockchain_deleted',
         {
-            'type': 'blockchain_deleted',
-            'message': {
-                'slug': blockchain_slug,
-            },
-        }
+            'slug': blockchain_slug,
+        },
     )
 
 
@@ -112,3 +207,24 @@ def update_graphs():
                 get_graph_fn(blockchain.slug)
             )
 
+
+@dramatiq.actor(max_retries=0, time_limit=float("inf"))
+def verify_chain_linkage_task(blockchain_slug, repair=False):
+    blockchain = Blockchain.objects.get(slug=blockchain_slug)
+    broken_links = get_broken_links(blockchain)
+    if not broken_links:
+        return
+    logger.warning(
+        'Broken main chain links',
+        extra={'blockchain': blockchain.slug, 'heights': broken_links},
+    )
+    if repair:
+        reorgs = repair_broken_links(blockchain, broken_links)
+        logger.info(
+            'Repaired main chain links',
+            extra={
+                'blockchain': blockchain.slug,
+                'reorgs': [reorg.pk for reorg in reorgs],
+                'heights': get_broken_links(blockchain),
+            },
+        )
@@ -1,4 +1,10 @@
-from django.test import TestCase
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from .models import (
     Blockchain,
     Block,
@@ -9,9 +15,42 @@ from .models import (
     Reorg,
     Node,
     NodeGroup,
+    SearchEntry,
+    StatsBucket,
+    UnspentOutput,
 )
-from .bootstrap import fetch_and_store_block
-from unittest.mock import patch, Mock
+from .bootstrap import (
+    fetch_and_store_block,
+    get_blockchain_snapshot,
+    render_blockchain_snapshot,
+)
+from .chain_index import ChainIndex
+from .consumers import RegularConsumer
+from .helpers import (
+    delete_blockchain_snapshot,
+    enqueue_accepted_height,
+    get_blockchain_group_name,
+    get_broken_links,
+    get_ingestion_lock,
+    get_prefetched_header_and_block_data,
+    has_accepted_heights,
+    node_cache,
+    pop_accepted_heights,
+    pop_pending_broadcast,
+    queue_blocks_broadcast,
+    queue_progress_broadcast,
+    repair_broken_links,
+    send_websocket_message,
+    sync_unspent_outputs,
+)
+from .tasks import flush_broadcasts, ingest_accepted_blocks
+from .stats import (
+    get_kernel_stats,
+    update_block_difficulty_stats,
+    update_stats,
+)
+from redis.lock import Lock
+from unittest.mock import AsyncMock, patch, Mock
 
 import json
 
@@ -20,6 +59,13 @@ class ReorgTestCase(TestCase):
     def setUp(self):
         self.patcher = patch('backend.api.bootstrap.NodeV2API')
         self.nodeV2APIMock = self.patcher.start()
+        self.prefetch_patcher = patch(
+            'backend.api.bootstrap.get_prefetched_header_and_block_data')
+        self.prefetchMock = self.prefetch_patcher.start()
+        # store accepted blocks right away instead of through the broker
+        self.ingest_patcher = patch.object(
+            ingest_accepted_blocks, 'send', side_effect=ingest_accepted_blocks.fn)
+        self.ingest_patcher.start()
         node_group = NodeGroup.objects.create(name='foo group')
         node = Node.objects.create(
             name='test',
@@ -38,6 +84,8 @@ class ReorgTestCase(TestCase):
 
     def tearDown(self):
         self.patcher.stop()
+        self.prefetch_patcher.stop()
+        self.ingest_patcher.stop()
 
     def to_hex(self, s):
         # in some cases some previous hash might be None
@@ -45,6 +93,31 @@ class ReorgTestCase(TestCase):
             return
         return bytes(s, 'utf-8').hex()
 
+    def _assert_output_state_in_sync(self):
+        # UTXO set must match main chain outputs which are not spent
+        unspent_output_ids = set(UnspentOutput.objects
+            .filter(blockchain=self.blockchain)
+            .values_list('output_id', flat=True))
+        expected_ids = set(Output.objects
+            .filter(
+                block__blockchain=self.blockchain,
+                block__reorg=None,
+                spent=False,
+            )
+            .values_list('id', flat=True))
+        self.assertEqual(unspent_output_ids, expected_ids)
+        # spent_in_block must match main chain input which spends the output
+        for output in Output.objects.filter(block__blockchain=self.blockchain):
+            main_inputs = [
+                input for input in output.inputs.all()
+                if input.block.reorg is None
+            ]
+            expected = (None, None)
+            if main_inputs:
+                expected = (main_inputs[0].block.height, main_inputs[0].block.hash)
+            self.assertEqual(
+                (output.spent_height, output.spent_in_block_id), expected)
+
     def _get_fake_header(self, height, hash, prev_hash):
         return {
             'cuckoo_solution': list(range(1, 43)),
@@ -85,6 +158,32 @@ class ReorgTestCase(TestCase):
             'outputs': outputs,
         }
 
+    def _mock_node(self, headers, blocks):
+        # the node returns the full header as a part of the block data
+        blocks = [
+            dict(block, header=header) for header, block in zip(headers, blocks)
+        ]
+        node_instance_mock = Mock()
+        queue = list(blocks)
+        # block whose header was returned, its full data is only returned if
+        # it's fetched right after it
+        header_blocks = []
+
+        def get_header(height=None, hash=None, commit=None):
+            header_blocks[:] = [queue.pop(0)]
+            return header_blocks[0]['header']
+
+        def get_block(height=None, hash=None, commit=None):
+            if header_blocks and header_blocks[0]['header']['height'] == height:
+                return header_blocks.pop()
+            header_blocks.clear()
+            return queue.pop(0)
+
+        node_instance_mock.get_header.side_effect = get_header
+        node_instance_mock.get_block.side_effect = get_block
+        self.nodeV2APIMock.return_value = node_instance_mock
+        self.prefetchMock.side_effect = list(blocks)
+
     def _get_accepted_block_data(self, height, hash, prev_hash):
         # return only the data that's read in the view
         if prev_hash:
@@ -115,7 +214,6 @@ class ReorgTestCase(TestCase):
             'spent': spent,
         }
 
-
     def test_reorg_through_accepted_block_view(self):
         """
         Test nested reorg scenario for accepted-block view.
@@ -201,10 +299,7 @@ class ReorgTestCase(TestCase):
             ]),  # h103
         ]
         # make sure node returns reorg data as defined in the function docs
-        node_instance_mock = Mock()
-        node_instance_mock.get_header.side_effect = headers
-        node_instance_mock.get_block.side_effect = blocks
-        self.nodeV2APIMock.return_value = node_instance_mock
+        self._mock_node(headers, blocks)
         # send new blocks to accepted-block view (includes 2 reorgs)
         for i in range(0, len(headers)):
             header = headers[i]
@@ -249,6 +344,38 @@ class ReorgTestCase(TestCase):
         self.assertEqual(reorg2.start_reorg_block.hash, self.to_hex('h101.2'))
         self.assertEqual(reorg2.end_reorg_block.hash, self.to_hex('h105.2'))
         self.assertEqual(reorg2.start_main_block.hash, self.to_hex('h101'))
+        # validate stats buckets, which should include only the main chain
+        for resolution in StatsBucket.Resolution.values:
+            stats = StatsBucket.objects.get(
+                blockchain=self.blockchain, resolution=resolution)
+            self.assertEqual(
+                (
+                    stats.nr_blocks,
+                    stats.nr_kernels,
+                    stats.nr_inputs,
+                    stats.nr_outputs,
+                    stats.fees,
+                ),
+                (4, 4, 4, 8, 4 * 30000000)
+            )
+        block = Block.objects.get(hash=self.to_hex('h105.2'))
+        self.assertEqual(
+            (block.fees, block.median_fee, block.nr_plain_kernels),
+            (30000000, 30000000, 1)
+        )
+        # validate stored reorg lengths and heights
+        self.assertEqual(
+            (reorg1.reorg_len, reorg1.start_main_height), (2, 3))
+        self.assertEqual(
+            (reorg2.reorg_len, reorg2.start_main_height), (5, 2))
+        # reorg1 started on a block which is now reorged too, so only the
+        # second reorg is found
+        response = self.client.get(
+            f'/api/blockchains/{self.blockchain.slug}/blocks/?search=reorgs')
+        self.assertEqual(
+            [block['hash'] for block in response.json()['results']],
+            [self.to_hex('h101')]
+        )
         # validate all inputs
         main_inputs = set(map(
             lambda input: (
@@ -266,14 +393,14 @@ class ReorgTestCase(TestCase):
             ('a', self.to_hex('h101'), None),
             ('b', self.to_hex('h102'), None),
             # reorg 2
-            ('g1', self.to_hex('h100'), 2),
-            ('a', self.to_hex('h101.2'), 2),
-            ('b', self.to_hex('h102.2'), 2),
-            ('c', self.to_hex('h102.2'), 2),
+            ('g1', self.to_hex('h100'), reorg2.id),
+            ('a', self.to_hex('h101.2'), reorg2.id),
+            ('b', self.to_hex('h102.2'), reorg2.id),
+            ('c', self.to_hex('h102.2'), reorg2.id),
             # reorg 1
-            ('g2', self.to_hex('h100'), 1),
-            ('a', self.to_hex('h101.2'), 1),
-            ('c', self.to_hex('h102.3'), 1),
+            ('g2', self.to_hex('h100'), reorg1.id),
+            ('a', self.to_hex('h101.2'), reorg1.id),
+            ('c', self.to_hex('h102.3'), reorg1.id),
         ])
         self.assertEqual(main_inputs, expected_inputs)
         # validate all outputs
@@ -313,6 +440,7 @@ class ReorgTestCase(TestCase):
             ('h', self.to_hex('h103.3'), False, tuple()),
         ])
         self.assertEqual(main_outputs, expected_outputs)
+        self._assert_output_state_in_sync()
 
     def test_reorg_through_load_blocks(self):
         """
@@ -377,10 +505,7 @@ class ReorgTestCase(TestCase):
                 3, 'h101', [], [self._get_output(3, 'b', False)]),
         ]
         # make sure node returns reorg data as defined in the function docs
-        node_instance_mock = Mock()
-        node_instance_mock.get_header.side_effect = headers
-        node_instance_mock.get_block.side_effect = blocks
-        self.nodeV2APIMock.return_value = node_instance_mock
+        self._mock_node(headers, blocks)
         # load initial regular chain
         load_blocks(self.blockchain, 1, 4, True)
         # check if 'spent' is correctly set
@@ -518,10 +643,7 @@ class ReorgTestCase(TestCase):
             ]),  # h102 - second reorg
         ]
         # make sure node returns reorg data as defined in the function docs
-        node_instance_mock = Mock()
-        node_instance_mock.get_header.side_effect = headers
-        node_instance_mock.get_block.side_effect = blocks
-        self.nodeV2APIMock.return_value = node_instance_mock
+        self._mock_node(headers, blocks)
 
         # send first 4 blocks to accepted-block view (includes 1 reorg)
         for i in range(4):
@@ -613,6 +735,7 @@ class ReorgTestCase(TestCase):
             ('b', self.to_hex('h101'), False, tuple()),
         ])
         self.assertEqual(main_outputs, expected_outputs)
+        self._assert_output_state_in_sync()
         # send the last block to accepted-block view (creates a new reorg)
         header = headers[-1]
         post_data = self._get_accepted_block_data(
@@ -705,6 +828,7 @@ class ReorgTestCase(TestCase):
             ('f', self.to_hex('h102.1'), False, tuple()),
         ])
         self.assertEqual(main_outputs, expected_outputs)
+        self._assert_output_state_in_sync()
 
     def test_accepted_block_duplicate_view(self):
         """Test accepted-block view receives already stored block."""
@@ -723,10 +847,7 @@ class ReorgTestCase(TestCase):
             ]),  # duplicate block received
         ]
         # make sure node returns reorg data as defined in the function docs
-        node_instance_mock = Mock()
-        node_instance_mock.get_header.side_effect = headers
-        node_instance_mock.get_block.side_effect = blocks
-        self.nodeV2APIMock.return_value = node_instance_mock
+        self._mock_node(headers, blocks)
 
         # send blocks, the first one is just to get it in db, the second one is
         # to test the duplicate one
@@ -756,4 +877,994 @@ class ReorgTestCase(TestCase):
             for block in main_chain_blocks
         ]
         self.assertEqual(actual_main_chain, expected_main_chain)
+        # only the header of the duplicate block is fetched from the node
+        node_instance_mock = self.nodeV2APIMock.return_value
+        self.assertEqual(node_instance_mock.get_block.call_count, 1)
+        self.assertEqual(node_instance_mock.get_header.call_count, 1)
+
+    def test_accepted_blocks_queue(self):
+        """
+        Test that accepted-block view only queues heights, duplicates are
+        coalesced and the task stores them by ascending height in a batch.
+        """
+        headers = [
+            self._get_fake_header(1, 'h100', None),  # genesis
+            self._get_fake_header(2, 'h101', 'h100'),
+        ]
+        blocks = [
+            self._get_fake_block(1, None, [], [self._get_output(1, 'g1', False)]),
+            self._get_fake_block(2, 'h100', [], [self._get_output(2, 'a', False)]),
+        ]
+        self._mock_node(headers, blocks)
+        with patch.object(ingest_accepted_blocks, 'send') as send_mock:
+            for header in [headers[1], headers[0], headers[1]]:
+                post_data = self._get_accepted_block_data(
+                    header['height'], header['hash'], header['previous']
+                )
+                response = self.client.post(
+                    f'/api/blockchains/{self.blockchain.slug}/accepted/',
+                    json.dumps(post_data),
+                    content_type="application/json"
+                )
+                self.assertEqual(response.status_code, 200)
+            response = self.client.post(
+                f'/api/blockchains/{self.blockchain.slug}/accepted/',
+                json.dumps({'hash': 'foo'}),
+                content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(send_mock.call_count, 3)
+        self.assertFalse(self.blockchain.blocks.exists())
+        with patch('backend.api.bootstrap.prefetch_blocks') as prefetch_mock:
+            ingest_accepted_blocks.fn(self.blockchain.slug)
+        # both heights are fetched with a single range request
+        prefetch_mock.assert_called_once_with(self.blockchain.node, [1, 2])
+        self.assertEqual(
+            list(self.blockchain.blocks
+                .order_by('height')
+                .values_list('hash', flat=True)),
+            [self.to_hex('h100'), self.to_hex('h101')],
+        )
+        node_instance_mock = self.nodeV2APIMock.return_value
+        self.assertEqual(node_instance_mock.get_block.call_count, 0)
+        self.assertEqual(self.prefetchMock.call_count, 2)
+        self.assertEqual(pop_accepted_heights(self.blockchain.slug, 10), [])
+
+    def test_accepted_blocks_queue_with_gaps(self):
+        """
+        Test that queued heights which are not consecutive are prefetched in
+        separate ranges into the same cache, so that neither the blocks
+        between them nor the earlier ranges are downloaded again.
+        """
+        names = [
+            (1, 'h100', None),
+            (2, 'h101', 'h100'),
+            (1000, 'h1099', 'h1098'),
+        ]
+        headers = [
+            self._get_fake_header(height, hash, prev_hash)
+            for height, hash, prev_hash in names
+        ]
+        blocks = [
+            self._get_fake_block(
+                height, prev_hash, [], [self._get_output(height, hash, False)])
+            for height, hash, prev_hash in names
+        ]
+        node_blocks = [
+            dict(block, header=header) for header, block in zip(headers, blocks)
+        ]
+        node_api_mock = Mock()
+        node_api_mock.get_blocks.side_effect = lambda start, end: {
+            'blocks': [
+                block for block in node_blocks
+                if start <= block['header']['height'] <= end
+            ],
+        }
+        self.addCleanup(node_cache.pop, self.blockchain.node.slug, None)
+        for height, _, _ in names:
+            enqueue_accepted_height(self.blockchain.slug, height)
+        # use the real cache of prefetched blocks
+        with patch('backend.api.helpers.NodeV2API', return_value=node_api_mock), \
+                patch(
+                    'backend.api.bootstrap.get_prefetched_header_and_block_data',
+                    get_prefetched_header_and_block_data,
+                ):
+            ingest_accepted_blocks.fn(self.blockchain.slug)
+        self.assertEqual(
+            [call.args for call in node_api_mock.get_blocks.call_args_list],
+            [(1, 2), (1000, 1000)],
+        )
+        self.assertEqual(
+            list(self.blockchain.blocks
+                .order_by('height')
+                .values_list('height', flat=True)),
+            [1, 2, 1000],
+        )
+
+    def test_accepted_blocks_queue_failure(self):
+        """
+        Test that when a block fails to be stored, its height and the rest of
+        the batch are queued again and the blocks stored before it are still
+        broadcasted.
+        """
+        from backend.api.bootstrap import store_accepted_block
+
+        names = [
+            (1, 'h100', None),
+            (2, 'h101', 'h100'),
+            (3, 'h102', 'h101'),
+        ]
+        headers = [
+            self._get_fake_header(height, hash, prev_hash)
+            for height, hash, prev_hash in names
+        ]
+        blocks = [
+            self._get_fake_block(
+                height, prev_hash, [], [self._get_output(height, hash, False)])
+            for height, hash, prev_hash in names
+        ]
+        self._mock_node(headers, blocks)
+        for height, _, _ in names:
+            enqueue_accepted_height(self.blockchain.slug, height)
+        # clear leftovers of previous tests
+        pop_pending_broadcast(self.blockchain.slug)
+
+        def store_or_fail(blockchain, height, prefetch=False):
+            if height == 2:
+                raise Exception('node timeout')
+            return store_accepted_block(blockchain, height, prefetch=prefetch)
+
+        with patch('backend.api.bootstrap.prefetch_blocks'), \
+                patch(
+                    'backend.api.bootstrap.store_accepted_block',
+                    side_effect=store_or_fail,
+                ):
+            with self.assertRaisesMessage(Exception, 'node timeout'):
+                ingest_accepted_blocks.fn(self.blockchain.slug)
+        self.assertEqual(
+            list(self.blockchain.blocks.values_list('height', flat=True)),
+            [1],
+        )
+        self.assertEqual(
+            pop_pending_broadcast(self.blockchain.slug)['nr_blocks'], 1)
+        self.assertEqual(pop_accepted_heights(self.blockchain.slug, 10), [2, 3])
+
+    def test_ingestion_lock_hand_off(self):
+        """
+        Test that accepted blocks wait while bootstrap holds the ingestion
+        lock and that bootstrap stores them before its own blocks.
+        """
+        from backend.api.bootstrap import load_blocks
+
+        headers = [
+            self._get_fake_header(3, 'h102', 'h101'),  # accepted block
+            self._get_fake_header(2, 'h101', 'h100'),
+            self._get_fake_header(1, 'h100', None),  # genesis
+        ]
+        blocks = [
+            self._get_fake_block(3, 'h101', [], [self._get_output(3, 'b', False)]),
+            self._get_fake_block(2, 'h100', [], [self._get_output(2, 'a', False)]),
+            self._get_fake_block(1, None, [], [self._get_output(1, 'g1', False)]),
+        ]
+        self._mock_node(headers, blocks)
+        # bootstrap prefetches its blocks, the accepted one is fetched alone
+        self.prefetchMock.side_effect = [
+            dict(block, header=header)
+            for header, block in zip(headers[1:], blocks[1:])
+        ]
+        lock = get_ingestion_lock(self.blockchain.slug)
+        lock.acquire()
+        try:
+            post_data = self._get_accepted_block_data(
+                3, headers[0]['hash'], headers[0]['previous'])
+            self.client.post(
+                f'/api/blockchains/{self.blockchain.slug}/accepted/',
+                json.dumps(post_data),
+                content_type="application/json"
+            )
+        finally:
+            lock.release()
+        # the lock was held so the block is still queued
+        self.assertFalse(self.blockchain.blocks.exists())
+        self.assertTrue(has_accepted_heights(self.blockchain.slug))
+        load_blocks(self.blockchain, 1, 2, False)
+        self.assertFalse(has_accepted_heights(self.blockchain.slug))
+        self.assertEqual(
+            list(self.blockchain.blocks
+                .order_by('created')
+                .values_list('height', flat=True)),
+            [3, 2, 1],
+        )
+        self.assertFalse(lock.locked())
+
+    def test_load_blocks_reorg_check_stops_at_missing_height(self):
+        """
+        Test that reorg checks of a fresh bootstrap don't walk into missing
+        heights, they're loaded one by one by the outer loop which renews the
+        ingestion lock for each of them.
+        """
+        from backend.api.bootstrap import load_blocks
+
+        names = [
+            (height, f'h{height}', f'h{height - 1}' if height > 1 else None)
+            for height in range(40, 0, -1)
+        ]
+        headers = [
+            self._get_fake_header(height, hash, prev_hash)
+            for height, hash, prev_hash in names
+        ]
+        blocks = [
+            self._get_fake_block(
+                height, prev_hash, [], [self._get_output(height, hash, False)])
+            for height, hash, prev_hash in names
+        ]
+        self._mock_node(headers, blocks)
+        with patch.object(
+            Lock, 'reacquire', autospec=True, side_effect=Lock.reacquire
+        ) as reacquire_mock:
+            load_blocks(self.blockchain, 1, 40, False)
+        self.assertEqual(reacquire_mock.call_count, 40)
+        self.assertEqual(self.blockchain.blocks.count(), 40)
+        self.assertFalse(Reorg.objects.exists())
+        self.assertEqual(get_broken_links(self.blockchain), [])
+
+    @patch(
+        'rest_framework.throttling.SimpleRateThrottle.allow_request',
+        return_value=True,
+    )
+    def test_large_reorg_through_accepted_block_view(self, allow_request_mock):
+        """
+        Test a 30 blocks deep reorg for accepted-block view.
+
+        Main chain m0-m39 is replaced from height 11 on by fork f10-f44. Both
+        chains spend their previous block's output and every third block on
+        both chains includes the same transaction.
+        """
+        def get_block(chain, i):
+            name = f'{chain}{i}'
+            prev_name = None
+            if i > 0:
+                prev_name = f'{chain if chain == "m" or i > 10 else "m"}{i - 1}'
+            inputs = [prev_name] if prev_name else []
+            outputs = [self._get_output(i + 1, name, False)]
+            if i % 3 == 0:
+                outputs.append(self._get_output(i + 1, f'tx{i}', False))
+                if i >= 3:
+                    inputs.append(f'tx{i - 3}')
+            header = self._get_fake_header(i + 1, name, prev_name)
+            return header, self._get_fake_block(i + 1, prev_name, inputs, outputs)
+
+        chain = [get_block('m', i) for i in range(40)]
+        chain += [get_block('f', i) for i in range(10, 45)]
+        headers, blocks = zip(*chain)
+        self._mock_node(headers, blocks)
+        for header in headers:
+            post_data = self._get_accepted_block_data(
+                header['height'], header['hash'], header['previous']
+            )
+            self.client.post(
+                f'/api/blockchains/{self.blockchain.slug}/accepted/',
+                json.dumps(post_data),
+                content_type="application/json"
+            )
+        reorg = Reorg.objects.get()
+        self.assertEqual(
+            (reorg.reorg_len, reorg.start_main_height), (30, 11))
+        main_hashes = set(self.blockchain.blocks
+            .filter(reorg=None)
+            .values_list('hash', flat=True))
+        self.assertEqual(
+            main_hashes,
+            set(self.to_hex(f'm{i}') for i in range(10)) |
+            set(self.to_hex(f'f{i}') for i in range(10, 45)),
+        )
+        # every output is spent by an input from its own chain and every input
+        # is linked to the output from its own chain or the shared history
+        outputs = list(Output.objects.select_related('block'))
+        inputs = list(Input.objects.select_related('block', 'output__block'))
+        for output in outputs:
+            is_main = output.block.hash in main_hashes
+            spending_inputs = [
+                input for input in inputs
+                if input.commitment == output.commitment and
+                (input.block.hash in main_hashes) == is_main
+            ]
+            self.assertEqual(output.spent, bool(spending_inputs), output)
+        for input in inputs:
+            self.assertEqual(input.output.commitment, input.commitment)
+            if input.block.hash in main_hashes:
+                self.assertIn(input.output.block.hash, main_hashes)
+            elif input.output.block.hash in main_hashes:
+                # spends an output from before the fork
+                self.assertLess(input.output.block.height, 11)
+        self._assert_output_state_in_sync()
+
+    def _create_chain(self, name, heights, prev_hash):
+        # creates linked blocks without inputs and outputs, returns their hashes
+        hashes = []
+        for height in heights:
+            header = BlockHeader.objects.create(
+                blockchain=self.blockchain,
+                version=5,
+                kernel_root='foo-kernel-root',
+                output_root='foo-output-root',
+                range_proof_root='foo-range-proof-root',
+                kernel_mmr_size=1,
+                output_mmr_size=1,
+                nonce='1',
+                edge_bits=32,
+                cuckoo_solution='1,2,3',
+                secondary_scaling=0,
+                total_difficulty=height + 1,
+                total_kernel_offset='foo-total-kernel-offset',
+            )
+            block = Block.objects.create(
+                blockchain=self.blockchain,
+                hash=self.to_hex(f'{name}{height}').ljust(64, '0'),
+                height=height,
+                timestamp='2000-01-01T00:00:00+00:00',
+                header=header,
+                prev_hash=prev_hash,
+            )
+            prev_hash = block.hash
+            hashes.append(block.hash)
+        return hashes
+
+    def test_reorg_block_reassignment_query_count(self):
+        """
+        Test that fixing the state after a reorg takes the same number of
+        queries for short and long reorgs.
+        """
+        query_counts = []
+        for length in [10, 100]:
+            self.blockchain.reset()
+            genesis = self._create_chain('g', [0], None)[0]
+            main = self._create_chain('m', range(1, length + 2), genesis)
+            fork = self._create_chain('f', range(1, length + 1), genesis)
+            with CaptureQueriesContext(connection) as first:
+                first_reorg = Reorg.objects.create(
+                    blockchain=self.blockchain,
+                    start_reorg_block_id=main[0],
+                    end_reorg_block_id=main[-2],
+                    start_main_block_id=fork[0],
+                )
+            self.assertEqual(
+                set(self.blockchain.blocks
+                    .filter(reorg=first_reorg)
+                    .values_list('hash', flat=True)),
+                set(main[:-1]),
+            )
+            # the old chain comes back, the first reorg has no blocks left
+            with CaptureQueriesContext(connection) as second:
+                second_reorg = Reorg.objects.create(
+                    blockchain=self.blockchain,
+                    start_reorg_block_id=fork[0],
+                    end_reorg_block_id=fork[-1],
+                    start_main_block_id=main[0],
+                )
+            self.assertEqual(
+                set(self.blockchain.blocks
+                    .filter(reorg=None)
+                    .values_list('hash', flat=True)),
+                set([genesis] + main),
+            )
+            self.assertEqual(
+                list(Reorg.objects.values_list('id', flat=True)),
+                [second_reorg.id],
+            )
+            query_counts.append((len(first), len(second)))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_chain_index(self):
+        genesis = self._create_chain('g', [0], None)[0]
+        main = self._create_chain('m', range(1, 4), genesis)
+        chain_index = ChainIndex.load(self.blockchain, 1, 2)
+        self.assertIsNone(chain_index.get(0))
+        self.assertEqual(chain_index.get(1), (main[0], genesis))
+        self.assertEqual(chain_index.get(2), (main[1], main[0]))
+        self.assertIsNone(chain_index.get(3))
+        # the index grows in both directions and keeps short hashes
+        chain_index.set(5, 'ab', 'cd')
+        chain_index.set(0, genesis, None)
+        self.assertEqual(chain_index.get(0), (genesis, None))
+        self.assertIsNone(chain_index.get(4))
+        self.assertEqual(chain_index.get(5), ('ab', 'cd'))
+        self.assertEqual(chain_index.get(1), (main[0], genesis))
+
+    def test_verify_and_repair_chain_linkage(self):
+        """
+        Test that a reorg missed during bootstrap is found as a broken link
+        and repaired.
+
+        Stored main chain: 100, 101, 102.1, 103.1, 104 where 104 was fetched
+        before the reorg and links to 103 instead of 103.1.
+        """
+        from backend.api.bootstrap import load_blocks
+
+        names = [
+            (5, 'h104', 'h103'),
+            (4, 'h103.1', 'h102.1'),
+            (3, 'h102.1', 'h101'),
+            (2, 'h101', 'h100'),
+            (1, 'h100', None),
+            # repair fetches, 104 is already stored
+            (4, 'h103', 'h102'),
+            (3, 'h102', 'h101'),
+        ]
+        headers = [
+            self._get_fake_header(height, hash, prev_hash)
+            for height, hash, prev_hash in names
+        ]
+        blocks = [
+            self._get_fake_block(
+                height, prev_hash, [], [self._get_output(height, hash, False)])
+            for height, hash, prev_hash in names
+        ]
+        self._mock_node(headers, blocks)
+        load_blocks(self.blockchain, 1, 5, True)
+        self.assertEqual(get_broken_links(self.blockchain), [[5, 5]])
+        with patch.object(
+            Lock, 'reacquire', autospec=True, side_effect=Lock.reacquire
+        ) as reacquire_mock:
+            reorgs = repair_broken_links(
+                self.blockchain, get_broken_links(self.blockchain))
+        # the lock is renewed for the range and for each block of the walk
+        self.assertEqual(reacquire_mock.call_count, 3)
+        self.assertEqual(
+            [(reorg.reorg_len, reorg.start_main_height) for reorg in reorgs],
+            [(2, 3)],
+        )
+        self.assertEqual(get_broken_links(self.blockchain), [])
+        self.assertEqual(
+            set(self.blockchain.blocks
+                .filter(reorg=None)
+                .values_list('hash', flat=True)),
+            set(self.to_hex(name) for name in [
+                'h100', 'h101', 'h102', 'h103', 'h104']),
+        )
+        self._assert_output_state_in_sync()
+
+    def test_load_blocks_lost_ingestion_lock(self):
+        """
+        Test that loading stops without an error when the ingestion lock
+        expired and another writer took it.
+        """
+        from backend.api.bootstrap import load_blocks
+
+        names = [
+            (height, f'h{height}', f'h{height - 1}' if height > 1 else None)
+            for height in range(5, 0, -1)
+        ]
+        headers = [
+            self._get_fake_header(height, hash, prev_hash)
+            for height, hash, prev_hash in names
+        ]
+        blocks = [
+            self._get_fake_block(
+                height, prev_hash, [], [self._get_output(height, hash, False)])
+            for height, hash, prev_hash in names
+        ]
+        self._mock_node(headers, blocks)
+        other_lock = get_ingestion_lock(self.blockchain.slug)
+        # don't block other tests if an assertion fails
+        self.addCleanup(other_lock.redis.delete, other_lock.name)
+        nr_calls = []
+        lock_reacquire = Lock.reacquire
+
+        def reacquire(lock):
+            nr_calls.append(1)
+            if len(nr_calls) == 2:
+                # the lock expires and another writer takes it
+                lock.redis.delete(lock.name)
+                other_lock.acquire()
+            return lock_reacquire(lock)
+
+        with patch.object(
+            Lock, 'reacquire', autospec=True, side_effect=reacquire
+        ):
+            load_blocks(self.blockchain, 1, 5, False)
+        # the other writer's lock is not released
+        self.assertTrue(other_lock.owned())
+        other_lock.release()
+        self.assertEqual(
+            list(self.blockchain.blocks.values_list('height', flat=True)),
+            [5],
+        )
+
+    def test_repair_stale_tip(self):
+        """
+        Test that a stale block at the top of a broken range is replaced.
+
+        Stored main chain: 100, 101, 102, 103.1 where 103.1 links to 102.1
+        which was never stored, the node's block at that height is 103.
+        """
+        from backend.api.bootstrap import load_blocks
+
+        names = [
+            (4, 'h103.1', 'h102.1'),
+            (3, 'h102', 'h101'),
+            (2, 'h101', 'h100'),
+            (1, 'h100', None),
+            (4, 'h103', 'h102'),
+        ]
+        headers = [
+            self._get_fake_header(height, hash, prev_hash)
+            for height, hash, prev_hash in names
+        ]
+        blocks = [
+            self._get_fake_block(
+                height, prev_hash, [], [self._get_output(height, hash, False)])
+            for height, hash, prev_hash in names
+        ]
+        self._mock_node(headers, blocks)
+        load_blocks(self.blockchain, 1, 4, True)
+        self.assertEqual(get_broken_links(self.blockchain), [[4, 4]])
+        # the node only knows the new block at the top
+        self._mock_node(headers[4:], blocks[4:])
+        reorgs = repair_broken_links(
+            self.blockchain, get_broken_links(self.blockchain))
+        self.assertEqual(
+            [(reorg.reorg_len, reorg.start_main_height) for reorg in reorgs],
+            [(1, 4)],
+        )
+        self.assertEqual(get_broken_links(self.blockchain), [])
+        self.assertEqual(
+            list(self.blockchain.blocks
+                .filter(reorg=None)
+                .order_by('height')
+                .values_list('hash', flat=True)),
+            [self.to_hex(name) for name in ['h100', 'h101', 'h102', 'h103']],
+        )
+        self.assertEqual(
+            list(reorgs[0].blocks.values_list('hash', flat=True)),
+            [self.to_hex('h103.1')],
+        )
+        self._assert_output_state_in_sync()
+        # a second main block at a height is broken even if it's linked
+        self._create_chain('x', [4], self.to_hex('h102'))
+        self.assertEqual(get_broken_links(self.blockchain), [[4, 4]])
+
+
+class BlockViewSetTestCase(TestCase):
+    def setUp(self):
+        node_group = NodeGroup.objects.create(name='foo group')
+        node = Node.objects.create(
+            name='test',
+            api_url='foo_url',
+            api_username='foouser',
+            api_password='foopw',
+            archive=False,
+            group=node_group,
+        )
+        self.blockchain = Blockchain.objects.create(
+            name='test',
+            node=node,
+            default=True,
+            fetch_price=False,
+        )
+        header = BlockHeader.objects.create(
+            blockchain=self.blockchain,
+            version=5,
+            kernel_root='foo-kernel-root',
+            output_root='foo-output-root',
+            range_proof_root='foo-range-proof-root',
+            kernel_mmr_size=1,
+            output_mmr_size=1,
+            nonce='1',
+            edge_bits=32,
+            cuckoo_solution='1,2,3',
+            secondary_scaling=0,
+            total_difficulty=1,
+            total_kernel_offset='foo-total-kernel-offset',
+        )
+        self.block = Block.objects.create(
+            blockchain=self.blockchain,
+            hash='a' * 64,
+            height=1,
+            timestamp='2000-01-01T00:00:00+00:00',
+            header=header,
+            nr_outputs=1,
+            nr_kernels=1,
+            nr_coinbase_kernels=1,
+        )
+        Output.objects.create(
+            block=self.block,
+            output_type='Coinbase',
+            commitment='c' * 66,
+            spent=False,
+            proof='foo-proof',
+            proof_hash='foo-proof-hash',
+            merkle_proof=None,
+            mmr_index=1,
+        )
+        Kernel.objects.create(
+            block=self.block,
+            features='Coinbase',
+            fee=0,
+            fee_shift=0,
+            lock_height=0,
+            excess='e' * 66,
+            excess_sig='foo-excess-sig',
+        )
+
+    def _get_block_detail(self, query=''):
+        response = self.client.get(
+            f'/api/blockchains/{self.blockchain.slug}/blocks/'
+            f'{self.block.hash}/{query}'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_block_detail_all_fields(self):
+        data = self._get_block_detail()
+        self.assertEqual(data['outputs'][0]['proof'], 'foo-proof')
+        self.assertEqual(len(data['kernels']), 1)
+
+    def test_block_detail_exclude_nested_fields(self):
+        data = self._get_block_detail(
+            '?exclude=outputs.proof,outputs.merkle_proof,kernels')
+        self.assertNotIn('kernels', data)
+        self.assertNotIn('proof', data['outputs'][0])
+        self.assertNotIn('merkle_proof', data['outputs'][0])
+        self.assertEqual(data['outputs'][0]['commitment'], 'c' * 66)
+
+    def test_block_detail_sparse_fields(self):
+        data = self._get_block_detail('?fields=hash,outputs.commitment')
+        self.assertEqual(set(data.keys()), {'hash', 'outputs'})
+        self.assertEqual(data['outputs'], [{'commitment': 'c' * 66}])
+
+    def test_block_detail_input_created_in(self):
+        block = Block.objects.create(
+            blockchain=self.blockchain,
+            hash='b' * 64,
+            height=2,
+            timestamp='2000-01-01T00:01:00+00:00',
+            header=self.block.header,
+            prev_hash=self.block.hash,
+        )
+        Input.objects.create(
+            block=block,
+            commitment='c' * 66,
+            output=self.block.outputs.get(),
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f'/api/blockchains/{self.blockchain.slug}/blocks/'
+                f'{block.hash}/?fields=inputs'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()['inputs'][0]['created_in'], [1, self.block.hash])
+        # output's proofs are not loaded to get the creating block
+        self.assertFalse(any(
+            'proof' in query['sql'] for query in queries.captured_queries))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f'/api/blockchains/{self.blockchain.slug}/blocks/'
+                f'{block.hash}/inputs/'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()['results'][0]['created_in'], [1, self.block.hash])
+        self.assertFalse(any(
+            'proof' in query['sql'] for query in queries.captured_queries))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f'/api/blockchains/{self.blockchain.slug}/blocks/'
+                f'{block.hash}/?summary=1'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()['inputs'][0]['created_in'], [1, self.block.hash])
+        # only the page of the block's own outputs loads the proofs
+        self.assertEqual(
+            len([
+                query for query in queries.captured_queries
+                if '"api_output"."proof"' in query['sql']
+            ]),
+            1,
+        )
+
+    def test_block_detail_summary(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self._get_block_detail('?summary=1&page_size=1')
+        # spent state of outputs is read from their own columns
+        self.assertFalse(any(
+            '"api_input"."output_id" IN' in query['sql']
+            for query in queries.captured_queries
+        ))
+        self.assertEqual(data['nr_outputs'], 1)
+        self.assertEqual(data['nr_kernels'], 1)
+        self.assertEqual(data['nr_inputs'], 0)
+        self.assertEqual(len(data['outputs']), 1)
+        self.assertEqual(data['inputs'], [])
+
+    def test_block_outputs_sub_resource(self):
+        response = self.client.get(
+            f'/api/blockchains/{self.blockchain.slug}/blocks/'
+            f'{self.block.hash}/outputs/?exclude=proof'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 1)
+        self.assertNotIn('proof', data['results'][0])
+        self.assertEqual(data['results'][0]['spent_in'], None)
+        response = self.client.get(
+            f'/api/blockchains/{self.blockchain.slug}/blocks/'
+            f'{"b" * 64}/outputs/'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_block_export(self):
+        url = (
+            f'/api/blockchains/{self.blockchain.slug}/blocks/export/'
+            '?start_height=0&end_height=10&include=outputs'
+        )
+        response = self.client.get(url)
+        self.assertIn(response.status_code, [401, 403])
+        user = User.objects.create_user(username='foo', password='foopw')
+        self.client.force_login(user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        block_data = json.loads(lines[0])
+        self.assertEqual(block_data['hash'], self.block.hash)
+        self.assertEqual(len(block_data['outputs']), 1)
+        self.assertNotIn('kernels', block_data)
+
+    def test_block_search_by_kernel_and_output(self):
+        for term, type in [('e' * 66, 'kernel'), ('c' * 66, 'output')]:
+            SearchEntry.objects.create(
+                blockchain=self.blockchain,
+                term=term,
+                type=type,
+                block=self.block,
+                height=self.block.height,
+            )
+        # full terms and prefixes
+        for term in ['e' * 66, 'c' * 66, 'eeeeeee', 'C' * 10]:
+            response = self.client.get(
+                f'/api/blockchains/{self.blockchain.slug}/blocks/'
+                f'?search={term}'
+            )
+            self.assertEqual(response.status_code, 200)
+            results = response.json()['results']
+            self.assertEqual([x['hash'] for x in results], [self.block.hash])
+
+    def test_kernel_stats(self):
+        kernels_data = [
+            {'features': 'Coinbase', 'fee': 0},
+            {'features': 'Plain', 'fee': 7},
+            {'features': 'Plain', 'fee': 3},
+            {'features': 'HeightLocked', 'fee': 5},
+            {'features': 'Plain', 'fee': 9},
+        ]
+        self.assertEqual(get_kernel_stats(kernels_data), {
+            'nr_plain_kernels': 3,
+            'nr_coinbase_kernels': 1,
+            'nr_height_locked_kernels': 1,
+            'nr_no_recent_duplicate_kernels': 0,
+            'fees': 24,
+            'min_fee': 3,
+            'max_fee': 9,
+            # lower median of the non-coinbase fees
+            'median_fee': 5,
+        })
+        self.assertEqual(
+            get_kernel_stats(kernels_data[:1])['median_fee'], None)
+
+    def test_blockchain_timeseries(self):
+        self.block.refresh_from_db()
+        update_stats(self.blockchain, [self.block.timestamp])
+        url = f'/api/blockchains/{self.blockchain.slug}/timeseries/'
+        response = self.client.get(
+            url + '?start=1999-12-01&end=2000-01-10&metrics=blocks,kernel_features')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age', response['Cache-Control'])
+        data = response.json()
+        # the finest resolution which fits max points is picked
+        self.assertEqual(data['resolution'], 'hour')
+        self.assertEqual(data['results'], [{
+            'start': '2000-01-01T00:00:00Z',
+            'blocks': 1,
+            'kernel_features': {
+                'plain': 0,
+                'coinbase': 1,
+                'height_locked': 0,
+                'no_recent_duplicate': 0,
+            },
+        }])
+        response = self.client.get(
+            url + '?start=1999-12-01&end=2000-01-10&resolution=week'
+            '&metrics=transactions,supply,emission')
+        self.assertEqual(
+            response.json()['results'],
+            [{
+                'start': '1999-12-27T00:00:00Z',
+                'transactions': 0,
+                # genesis and the block at height 1
+                'supply': 2 * 60 * 10**9,
+                'emission': 60 * 10**9,
+            }],
+        )
+        response = self.client.get(url + '?metrics=foo')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(HASHRATE_WINDOW=2)
+    def test_block_difficulty_stats(self):
+        prev_block = self.block
+        for height, total_difficulty, timestamp in [
+            (2, 11, '2000-01-01T00:01:00+00:00'),
+            (3, 41, '2000-01-01T00:01:30+00:00'),
+        ]:
+            header = BlockHeader.objects.create(
+                blockchain=self.blockchain,
+                version=5,
+                kernel_root=f'foo-kernel-root-{height}',
+                output_root='foo-output-root',
+                range_proof_root='foo-range-proof-root',
+                kernel_mmr_size=1,
+                output_mmr_size=1,
+                nonce='1',
+                edge_bits=32,
+                cuckoo_solution='1,2,3',
+                secondary_scaling=0,
+                total_difficulty=total_difficulty,
+                total_kernel_offset='foo-total-kernel-offset',
+            )
+            prev_block = Block.objects.create(
+                blockchain=self.blockchain,
+                hash=str(height) * 64,
+                height=height,
+                timestamp=timestamp,
+                header=header,
+                prev_hash=prev_block.hash,
+            )
+        update_block_difficulty_stats(self.blockchain, 1, 3)
+        response = self.client.get(
+            f'/api/blockchains/{self.blockchain.slug}/blocks/difficulty/'
+            '?start_height=1&end_height=3'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                (x['height'], x['difficulty'], x['block_time'], x['hashrate'])
+                for x in response.json()
+            ],
+            [
+                # block at height 1 has no stored previous block
+                (1, None, None, None),
+                (2, 10, 60, None),
+                # (10 + 30) / (60 + 30)
+                (3, 30, 30, 40 / 90),
+            ],
+        )
+
+    def test_blockchain_snapshot(self):
+        delete_blockchain_snapshot(self.blockchain.slug)
+        self.block.refresh_from_db()
+        update_stats(self.blockchain, [self.block.timestamp])
+        snapshot = json.loads(get_blockchain_snapshot(self.blockchain.slug))
+        self.assertEqual(snapshot['type'], 'snapshot')
+        self.assertEqual(snapshot['message']['height'], 1)
+        self.assertEqual(snapshot['message']['nr_blocks'], 1)
+        self.assertEqual(
+            [block['hash'] for block in snapshot['message']['blocks']],
+            [self.block.hash],
+        )
+        # it's read from redis until it's rendered again
+        new_block = Block.objects.create(
+            blockchain=self.blockchain,
+            hash='b' * 64,
+            height=2,
+            timestamp='2000-01-01T00:01:00+00:00',
+            header=self.block.header,
+            prev_hash=self.block.hash,
+        )
+        new_block.refresh_from_db()
+        update_stats(self.blockchain, [new_block.timestamp])
+        self.assertEqual(
+            json.loads(get_blockchain_snapshot(self.blockchain.slug)),
+            snapshot,
+        )
+        snapshot = json.loads(render_blockchain_snapshot(self.blockchain))
+        self.assertEqual(snapshot['message']['height'], 2)
+        self.assertEqual(snapshot['message']['nr_blocks'], 2)
+        self.assertEqual(
+            [block['hash'] for block in snapshot['message']['blocks']],
+            [new_block.hash, self.block.hash],
+        )
+        delete_blockchain_snapshot(self.blockchain.slug)
+        self.assertIsNone(get_blockchain_snapshot('foo'))
+
+    def test_blockchain_unspent_outputs(self):
+        sync_unspent_outputs(self.blockchain)
+        url = f'/api/blockchains/{self.blockchain.slug}/unspent-outputs/'
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {'count': 1})
+        response = self.client.get(url + '?commitment=' + 'C' * 66)
+        self.assertEqual(response.json(), {
+            'commitment': 'c' * 66,
+            'unspent': True,
+            'block': [1, self.block.hash],
+        })
+        Output.objects.update(spent=True)
+        sync_unspent_outputs(self.blockchain, ['c' * 66])
+        response = self.client.get(url + '?commitment=' + 'c' * 66)
+        self.assertFalse(response.json()['unspent'])
+
+
+class RegularConsumerTestCase(TestCase):
+    async def test_blockchain_group_subscription(self):
+        # there's no snapshot of a blockchain which doesn't exist
+        delete_blockchain_snapshot('test')
+        communicator = WebsocketCommunicator(
+            RegularConsumer.as_asgi(), '/ws/socket-server/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'price_update')
+        await communicator.send_json_to(
+            {'type': 'subscribe', 'blockchain': 'test'})
+        # give the consumer time to join the group
+        self.assertTrue(await communicator.receive_nothing())
+        # messages of other blockchains are not received
+        await sync_to_async(send_websocket_message)(
+            get_blockchain_group_name('other'), 'reorged', 'other')
+        await sync_to_async(send_websocket_message)(
+            get_blockchain_group_name('test'), 'reorged', 'test')
+        response = await communicator.receive_json_from()
+        self.assertEqual(response, {'type': 'reorged', 'message': 'test'})
+        await communicator.disconnect()
+
+
+class BroadcastTestCase(TestCase):
+    def test_coalesced_broadcast(self):
+        slug = 'broadcast-test'
+        # clear leftovers of previous runs
+        pop_pending_broadcast(slug)
+        with patch.object(flush_broadcasts, 'send_with_options') as send_mock:
+            queue_blocks_broadcast(slug, [{'height': 1}], 1, False)
+            queue_progress_broadcast(slug, Decimal('10.5'))
+            queue_blocks_broadcast(
+                slug, [{'height': h} for h in range(2, 100)], 98, False)
+            queue_progress_broadcast(slug, Decimal('20.00'))
+        # one broadcast is scheduled for all events in the interval
+        send_mock.assert_called_once()
+        with patch('backend.api.helpers.get_channel_layer') as layer_mock:
+            group_send = layer_mock.return_value.group_send = AsyncMock()
+            flush_broadcasts.fn(slug)
+        self.assertEqual(group_send.call_count, 2)
+        # messages are sent serialized
+        group, event = group_send.call_args_list[0].args
+        msg = json.loads(event['text'])
+        self.assertEqual(group, 'admin_group')
+        self.assertEqual(msg['message']['load_progress'], 20.0)
+        group, event = group_send.call_args_list[1].args
+        msg = json.loads(event['text'])
+        self.assertEqual(group, get_blockchain_group_name(slug))
+        self.assertEqual(msg['type'], 'new_blocks')
+        self.assertEqual(msg['message']['nr_blocks'], 99)
+        self.assertEqual(
+            [block['height'] for block in msg['message']['blocks']],
+            list(range(50, 100)),
+        )
+        self.assertEqual(pop_pending_broadcast(slug), {})
 
+    def test_broadcast_without_group(self):
+        # the slug can't be a part of a group name
+        slug = 'broadcast test'
+        self.assertIsNone(get_blockchain_group_name(slug))
+        pop_pending_broadcast(slug)
+        with patch.object(flush_broadcasts, 'send_with_options'):
+            queue_blocks_broadcast(slug, [{'height': 1}], 1, False)
+            queue_progress_broadcast(slug, Decimal('10.5'))
+        with patch('backend.api.helpers.get_channel_layer') as layer_mock:
+            group_send = layer_mock.return_value.group_send = AsyncMock()
+            flush_broadcasts.fn(slug)
+        # only the progress is sent, to the admins
+        self.assertEqual(group_send.call_count, 1)
+        group, _ = group_send.call_args.args
+        self.assertEqual(group, 'admin_group')
+        self.assertEqual(pop_pending_broadcast(slug), {})
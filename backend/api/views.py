@@ -1,6 +1,10 @@
-from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Prefetch
 from django.db.models.deletion import ProtectedError
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.generic import TemplateView
 from django.views.decorators.cache import never_cache
 from dramatiq_abort import abort
@@ -11,32 +15,62 @@ from rest_framework.exceptions import ValidationError as DRFValidationError
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 
 from slugify import slugify
 
-from .bootstrap import fetch_and_store_block, update_blockchain_progress
-from .exceptions import UpdateBlockchainProgressError
-from .helpers import get_filter_backends, load_data_from_redis
+from .graphs import TIMESERIES_METRICS, get_timeseries_data
+from .helpers import (
+    enqueue_accepted_height,
+    get_filter_backends,
+    load_data_from_redis,
+)
 from .filters import (
     BlockFilter,
     CustomBlockSearchFilter,
     NodeFilter,
     NodeGroupFilter,
 )
-from .mixins import CustomModelViewSet
-from .models import Blockchain, Block, Reorg, Node, NodeGroup, DramatiqTask
+from .mixins import (
+    CustomModelViewSet,
+    CustomReadOnlyModelViewSet,
+    DynamicFieldsViewMixin,
+)
+from .models import (
+    Blockchain,
+    Block,
+    Node,
+    NodeGroup,
+    DramatiqTask,
+    Input,
+    Output,
+    Kernel,
+    StatsBucket,
+)
 from .serializers import (
     BlockchainSerializer,
     BlockchainExtendedSerializer,
     BlockSerializer,
     BlockDetailSerializer,
+    BlockSummarySerializer,
+    BlockExportSerializer,
+    InputSerializer,
+    OutputSerializer,
+    KernelSerializer,
     NodeSerializer,
     NodeGroupSerializer,
     DramatiqTaskSerializer,
+    get_created_in_outputs,
+)
+from .stats import BUCKET_LENGTHS
+from .tasks import (
+    bootstrap_blockchain,
+    delete_blockchain,
+    ingest_accepted_blocks,
 )
-from .tasks import bootstrap_blockchain, delete_blockchain
 
-import channels
+from datetime import datetime, timedelta
+import json
 import logging
 import pytz
 
@@ -192,15 +226,106 @@ class BlockchainViewSet(CustomModelViewSet):
         }
         return Response(data=data, status=status.HTTP_200_OK)
 
+    def _get_datetime_param(self, param, default):
+        value = self.request.query_params.get(param)
+        if value is None:
+            return default
+        try:
+            res = parse_datetime(value)
+            if res is None:
+                date = parse_date(value)
+                if date is not None:
+                    res = datetime(date.year, date.month, date.day)
+        except ValueError:
+            res = None
+        if res is None:
+            raise DRFValidationError(
+                detail=f'Query param {param} must be an ISO date or datetime')
+        if res.tzinfo is None:
+            res = res.replace(tzinfo=pytz.utc)
+        return res
+
+    def _get_resolution(self, start, end):
+        resolutions = StatsBucket.Resolution.values
+        fitting = [
+            resolution
+            for resolution in resolutions
+            if (end - start) / BUCKET_LENGTHS[resolution] <= settings.TIMESERIES_MAX_POINTS
+        ]
+        resolution = self.request.query_params.get('resolution')
+        if resolution is None:
+            # use the finest resolution which doesn't exceed max points
+            return fitting[0] if fitting else resolutions[-1]
+        if resolution not in resolutions:
+            raise DRFValidationError(
+                detail='Query param resolution must be one of: {}'.format(
+                    ', '.join(resolutions)))
+        if resolution not in fitting:
+            raise DRFValidationError(
+                detail='Too many points, use a coarser resolution or a shorter range')
+        return resolution
+
+    @action(detail=True, methods=['get'])
+    def timeseries(self, request, slug=None):
+        """
+        Returns metrics of main chain blocks grouped in hourly, daily or weekly
+        buckets between 'start' (default 30 days ago) and 'end' (default now).
+        """
+        blockchain = self.get_object()
+        end = self._get_datetime_param('end', datetime.now(tz=pytz.utc))
+        start = self._get_datetime_param('start', end - timedelta(days=30))
+        if start >= end:
+            raise DRFValidationError(detail='start must be before end')
+        resolution = self._get_resolution(start, end)
+        metrics = TIMESERIES_METRICS
+        if request.query_params.get('metrics'):
+            metrics = request.query_params['metrics'].split(',')
+            unknown = set(metrics) - set(TIMESERIES_METRICS)
+            if unknown:
+                raise DRFValidationError(
+                    detail='Unknown metrics: {}'.format(', '.join(sorted(unknown))))
+        data = {
+            'resolution': resolution,
+            'results': get_timeseries_data(
+                blockchain, resolution, start, end, metrics),
+        }
+        response = Response(data=data, status=status.HTTP_200_OK)
+        # buckets change at most once per block
+        patch_cache_control(
+            response, public=True, max_age=settings.TIMESERIES_CACHE_MAX_AGE)
+        return response
+
+    @action(detail=True, methods=['get'], url_path='unspent-outputs')
+    def unspent_outputs(self, request, slug=None):
+        """
+        Returns size of the UTXO set or, when 'commitment' is given, whether
+        the output with this commitment is unspent.
+        """
+        blockchain = self.get_object()
+        commitment = request.query_params.get('commitment')
+        if commitment is None:
+            data = {'count': blockchain.unspent_outputs.count()}
+            return Response(data=data, status=status.HTTP_200_OK)
+        unspent_output = blockchain.unspent_outputs\
+            .filter(commitment=commitment.lower())\
+            .select_related('output__block')\
+            .first()
+        data = {
+            'commitment': commitment.lower(),
+            'unspent': unspent_output is not None,
+            'block': None,
+        }
+        if unspent_output:
+            block = unspent_output.output.block
+            data['block'] = (block.height, block.hash)
+        return Response(data=data, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'])
     def accepted(self, request, slug=None):
         # NOTE: if node is offline and then you start it again then it will
-        # call this view for each block it will get. In this case there will be
-        # many fast sequential calls to this view, there might be too many
-        # postgres connections opened so view executions might actually fail.
-        # The suggested solution is to comment out 'block_accepted_url' in
-        # node's config file, run the node, wait for it to sync, uncomment 
-        # 'block_accepted_url' and then manually bootstrap it.
+        # call this view for each block it will get. That's why this view only
+        # queues the height and the blocks are fetched and stored by the
+        # ingest_accepted_blocks task, one at a time per blockchain.
         blockchain = self.get_object()
         # check if new block has been receiver when this blockchain is in the
         # process of being deleted.
@@ -213,14 +338,18 @@ class BlockchainViewSet(CustomModelViewSet):
             # nothing to do, ignore the new block
             return Response(status=status.HTTP_404_NOT_FOUND)
         # get request data
-        height = request.data['data']['header']['height']
-        hash = request.data['hash']
+        try:
+            height = int(request.data['data']['header']['height'])
+            hash = request.data['hash']
+            prev_hash_bytes = request.data['data']['header']['prev_hash']
+        except (KeyError, TypeError, ValueError):
+            raise DRFValidationError('Invalid block data')
         # prev_hash comes as list of int bytes, so we convert it to hex
         # NOTE: the same is true for some other data which we currently don't
         # need so we don't transform it, eg. data.header.kernel_root
         prev_hash = None
-        if request.data['data']['header']['prev_hash']:
-            prev_hash = bytes(request.data['data']['header']['prev_hash']).hex()
+        if prev_hash_bytes:
+            prev_hash = bytes(prev_hash_bytes).hex()
         logger.info(
             'Block accepted',
             extra={
@@ -231,109 +360,10 @@ class BlockchainViewSet(CustomModelViewSet):
             },
         )
 
-        web_socket_msg_type = 'send_block'
-        # handle reorg case
-        # we expect blocks to come ordered by height, there are some edge cases
-        # here which are not handled, but they're unlikely to happen (eg. reorg
-        # happens but websocket calls for first blocks fails while for later it
-        # doesn't and then the code bellow wouldn't spot a reorg)
-        block_at_this_height = blockchain.blocks\
-            .filter(height=height, reorg__isnull=True)\
-            .first()
-        # we fetch here because anyone can call this view - we don't want to
-        # work with fake data
-        new_block = fetch_and_store_block(blockchain, height, prefetch=False)
-        if block_at_this_height:
-            if block_at_this_height.hash == new_block.hash:
-                # probably have fetched this block while bootstraping, accepted
-                # view got called a bit later so we already have it, noop
-                return Response(status=status.HTTP_200_OK)
-            logger.info(
-                'Block accepted - reorg spotted',
-                extra={
-                    'block_at_this_height': block_at_this_height,
-                    'block_at_this_height.hash': block_at_this_height.hash,
-                    'block_at_this_height.reorg': block_at_this_height.reorg,
-                    'hash': new_block.hash
-                },
-            )
-            # reorg spotted
-            reorged_blocks = list(blockchain.blocks\
-                .filter(height__gte=height, reorg__isnull=True)
-                .exclude(pk=new_block.pk)
-                .order_by('height'))
-            logger.info('reorged_blocks at start: {}'.format(reorged_blocks))
-            # these reorged blocks are guaranteed to be reorged, now find any
-            # previous blocks which were also reorged - aka get common
-            # ancestor of the reorged block at 'height' and the new (main) block
-
-            # find the common ancestor of this block and the reorged block at
-            # the same height. We start with the current height to avoid more
-            # logic for Reorg instance params
-            if new_block.hash == block_at_this_height.hash:
-                # at height X we got H1, then we got H2 (this call), but now it
-                # reorged back to H1, so we don't do anything, no reorg is
-                # stored since we didn't fetch the block in time from the node
-                logger.info('Reorg cancelled out, noop')
-                return Response(status=status.HTTP_200_OK)
-            logger.info('new_block', extra={'hash': new_block.hash, 'prev_hash': new_block.prev_hash})
-            prev_block_new_chain = new_block
-            prev_block_old_chain = reorged_blocks[0]
-            logger.info('prev_block_new_chain: {}, prev_block_old_chain: {}'.format(prev_block_new_chain, prev_block_old_chain))
-            # remove the first one since it will get added again
-            reorged_blocks = reorged_blocks[1:]
-            logger.info('reorged_blocks after [1:]: {}'.format(reorged_blocks))
-            main_blocks = []
-            while True:
-                # theoretically we might be missing the block in db but we don't
-                # cover such cases currently
-                if not prev_block_new_chain:
-                    logger.info('reached break in IF NOT prev_block_new_chain')
-                    # this means that prev_block_old_chain is also None, since
-                    # they're both "previous" of their genesis block
-                    break
-                if prev_block_new_chain == prev_block_old_chain:
-                    logger.info('reached break in IF NOT prev_block_new_chain == prev_block_old_chain')
-                    # found the common ancestor
-                    break
-                # add to the left because we want to keep it sorted by height
-                reorged_blocks.insert(0, prev_block_old_chain)
-                main_blocks.insert(0, prev_block_new_chain)
-                logger.info('new reorged_blocks: {}'.format(reorged_blocks))
-                logger.info('new main_blocks: {}'.format(main_blocks))
-                prev_block_new_chain = prev_block_new_chain.get_previous_block()
-                prev_block_old_chain = prev_block_old_chain.get_previous_block()
-                logger.info('new prev_block_new_chain: {}, prev_block_old_chain: {}'.format(prev_block_new_chain, prev_block_old_chain))
-
-            logger.info('before reorg create: reorged_blocks: {}, main_blocks: {}'.format(reorged_blocks, main_blocks))
-            reorg = Reorg.objects.create(
-                blockchain=blockchain,
-                start_reorg_block=reorged_blocks[0],
-                end_reorg_block=reorged_blocks[-1],
-                start_main_block=main_blocks[0],
-            )
-            # Reorg post_save signal fixes .reorg on new/old blocks and fixes
-            # inputs/outputs
-            web_socket_msg_type = 'reorged'
-        web_socket_msg = BlockSerializer(new_block).data
-        if web_socket_msg_type == 'reorged':
-            web_socket_msg = blockchain.slug
-        # TODO: check if channels-redis 4.x is fixed: https://github.com/django/channels_redis/issues/332
-        channel_layer = channels.layers.get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            'default_group',
-            {
-                'type': web_socket_msg_type,
-                'message': web_socket_msg,
-            }
-        )
-        # update the loading progress since it could be skewed due to the
-        # periodic task updating it before this view has been called
-        try:
-            update_blockchain_progress(blockchain)
-        except UpdateBlockchainProgressError:
-            # ignore it, let it update itself the next time
-            pass
+        # blocks are stored by a single task per blockchain, heights which are
+        # already queued are not added again
+        enqueue_accepted_height(blockchain.slug, height)
+        ingest_accepted_blocks.send(blockchain.slug)
         return Response(status=status.HTTP_200_OK)
 
     def get_permissions(self):
@@ -344,12 +374,19 @@ class BlockchainViewSet(CustomModelViewSet):
         # and fetch it from our node. Maybe in the future node could send some
         # header to prevent potential spam
         permission_classes = []
-        if self.action not in ['list', 'retrieve', 'accepted', 'graphs']:
+        if self.action not in [
+            'list',
+            'retrieve',
+            'accepted',
+            'graphs',
+            'timeseries',
+            'unspent_outputs',
+        ]:
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
 
 
-class BlockViewSet(CustomModelViewSet):
+class BlockViewSet(DynamicFieldsViewMixin, CustomModelViewSet):
     """API endpoint for Block. This ViewSet is nested in BlockchainViewSet."""
     queryset = Block.objects\
         .order_by('-height')\
@@ -363,7 +400,87 @@ class BlockViewSet(CustomModelViewSet):
         if self.action == 'list':
             return BlockSerializer
         if self.action == 'retrieve':
+            if self._is_summary():
+                return BlockSummarySerializer
             return BlockDetailSerializer
+        if self.action == 'export':
+            return BlockExportSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'export':
+            # kernels, inputs and outputs are exported only when included
+            context['exclude'] |= set(['kernels', 'inputs', 'outputs']) - \
+                self.get_requested_fields('include')
+        # used by BlockSummarySerializer
+        context['page_size'] = self.paginator.get_page_size(self.request)
+        return context
+
+    def _is_summary(self):
+        return self.request.query_params.get('summary', '0') == '1'
+
+    def _is_field_shown(self, name, fields, exclude):
+        """Mirrors field selection of serializers.DynamicFieldsMixin."""
+        if name in exclude:
+            return False
+        parent, _, field = name.rpartition('.')
+        if parent and not self._is_field_shown(parent, fields, exclude):
+            return False
+        prefix = f'{parent}.' if parent else ''
+        requested = [
+            name[len(prefix):] for name in fields if name.startswith(prefix)]
+        return not requested or field in [x.split('.')[0] for x in requested]
+
+    def _get_prefetches(self, fields, exclude):
+        """
+        Prefetches only the relations that will be serialized and defers their
+        heavy columns (eg. output's proof) which were not requested.
+        """
+        prefetches = []
+        # (relation, model, {serializer field: (prefetch it needs, queryset)},
+        #  {serializer field: model fields it needs})
+        relations = [
+            (
+                'inputs',
+                Input,
+                {
+                    # only the creating block's height and hash are shown,
+                    # output's proofs are not needed
+                    'created_in': ('output', get_created_in_outputs()),
+                },
+                {},
+            ),
+            ('outputs', Output, {}, {'spent_in': ['spent_height']}),
+            ('kernels', Kernel, {}, {}),
+        ]
+        for relation, model, nested_prefetches, sources in relations:
+            if not self._is_field_shown(relation, fields, exclude):
+                continue
+            needed = [
+                source
+                for field_name, field_sources in sources.items()
+                if self._is_field_shown(
+                    f'{relation}.{field_name}', fields, exclude)
+                for source in field_sources
+            ]
+            deferred = [
+                field.name
+                for field in model._meta.concrete_fields
+                if not field.primary_key and
+                not field.is_relation and
+                field.name not in needed and
+                not self._is_field_shown(
+                    f'{relation}.{field.name}', fields, exclude)
+            ]
+            prefetches.append(Prefetch(
+                relation, queryset=model.objects.defer(*deferred)))
+            prefetches.extend(
+                Prefetch(f'{relation}__{lookup}', queryset=queryset)
+                for field_name, (lookup, queryset) in nested_prefetches.items()
+                if self._is_field_shown(
+                    f'{relation}.{field_name}', fields, exclude)
+            )
+        return prefetches
 
     def get_queryset(self, *args, **kwargs):
         blockchain_slug = self.kwargs.get("blockchain_slug")
@@ -375,12 +492,11 @@ class BlockViewSet(CustomModelViewSet):
         # if there's a reorg at height X then block at height X, which is on the
         # main chain, will have reorg info included in its serializer
         queryset = self.queryset.filter(blockchain=blockchain)
-        if self.action == 'retrieve':
-            queryset = queryset.prefetch_related(
-                'inputs__output__block',
-                'outputs__inputs__block__reorg',
-                'kernels',
-            )
+        if self.action == 'retrieve' and not self._is_summary():
+            queryset = queryset.prefetch_related(*self._get_prefetches(
+                self.get_requested_fields('fields'),
+                self.get_requested_fields('exclude'),
+            ))
         elif (
             self.action == 'list' and
             not self.request.GET.get('include_reorgs', '0') == '1'
@@ -389,12 +505,128 @@ class BlockViewSet(CustomModelViewSet):
             queryset = self.queryset.filter(blockchain=blockchain, reorg=None)
         return queryset
 
+    def _get_height_param(self, param):
+        try:
+            height = int(self.request.query_params[param])
+        except (KeyError, ValueError):
+            raise DRFValidationError(
+                detail=f'Query param {param} must be a non-negative integer')
+        if height < 0:
+            raise DRFValidationError(
+                detail=f'Query param {param} must be a non-negative integer')
+        return height
+
+    def _stream_ndjson(self, queryset, serializer_class, context):
+        # iterator uses a server-side cursor so memory stays flat no matter how
+        # many blocks are exported
+        for block in queryset.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            data = serializer_class(block, context=context).data
+            yield json.dumps(data, cls=JSONEncoder) + '\n'
+
+    @action(detail=False, methods=['get'])
+    def difficulty(self, request, blockchain_slug=None):
+        """
+        Returns difficulty, block time and hashrate of main chain blocks with
+        heights between 'start_height' and 'end_height' (both included).
+        """
+        start_height = self._get_height_param('start_height')
+        end_height = self._get_height_param('end_height')
+        if start_height > end_height:
+            raise DRFValidationError(
+                detail='start_height must not be greater than end_height')
+        if end_height - start_height >= settings.TIMESERIES_MAX_POINTS:
+            raise DRFValidationError(
+                detail='Too many points, use a shorter range')
+        points = self.get_queryset()\
+            .filter(
+                reorg=None,
+                height__gte=start_height,
+                height__lte=end_height,
+            )\
+            .order_by('height')\
+            .values('height', 'timestamp', 'difficulty', 'block_time', 'hashrate')
+        response = Response(data=list(points), status=status.HTTP_200_OK)
+        patch_cache_control(
+            response, public=True, max_age=settings.TIMESERIES_CACHE_MAX_AGE)
+        return response
+
+    @action(detail=False, methods=['get'])
+    def export(self, request, blockchain_slug=None):
+        """
+        Streams main chain blocks with heights between 'start_height' and
+        'end_height' (both included) as newline delimited json. Their kernels,
+        inputs and outputs are included only if they're listed in 'include'
+        param, eg. '?include=kernels,outputs'.
+        """
+        start_height = self._get_height_param('start_height')
+        end_height = self._get_height_param('end_height')
+        if start_height > end_height:
+            raise DRFValidationError(
+                detail='start_height must not be greater than end_height')
+        context = self.get_serializer_context()
+        queryset = self.get_queryset()\
+            .filter(
+                reorg=None,
+                height__gte=start_height,
+                height__lte=end_height,
+            )\
+            .select_related('header')\
+            .prefetch_related(
+                *self._get_prefetches(context['fields'], context['exclude']))\
+            .order_by('height')
+        response = StreamingHttpResponse(
+            self._stream_ndjson(
+                queryset, self.get_serializer_class(), context),
+            content_type='application/x-ndjson',
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{blockchain_slug}-blocks-'
+            f'{start_height}-{end_height}.ndjson"'
+        )
+        return response
+
     def get_permissions(self):
         """
         Add, delete and update require authentication, others don't.
         """
         permission_classes = []
-        if self.action not in ['list', 'retrieve']:
+        if self.action not in ['list', 'retrieve', 'difficulty']:
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
 
+
+class BlockElementViewSet(DynamicFieldsViewMixin, CustomReadOnlyModelViewSet):
+    """
+    Base API endpoint for block's inputs, outputs and kernels. These ViewSets
+    are nested in BlockViewSet so that big blocks can be fetched page by page.
+    """
+
+    def get_queryset(self, *args, **kwargs):
+        block = Block.objects\
+            .filter(
+                blockchain__slug=self.kwargs.get('blockchain_slug'),
+                hash=self.kwargs.get('block_pk'),
+            )\
+            .first()
+        if not block:
+            raise NotFound('A block with this hash does not exist.')
+        return self.queryset.filter(block=block).order_by('id')
+
+
+class BlockInputViewSet(BlockElementViewSet):
+    """API endpoint for Input. This ViewSet is nested in BlockViewSet."""
+    queryset = Input.objects.prefetch_related(
+        Prefetch('output', queryset=get_created_in_outputs()))
+    serializer_class = InputSerializer
+
+
+class BlockOutputViewSet(BlockElementViewSet):
+    """API endpoint for Output. This ViewSet is nested in BlockViewSet."""
+    queryset = Output.objects.all()
+    serializer_class = OutputSerializer
+
+
+class BlockKernelViewSet(BlockElementViewSet):
+    """API endpoint for Kernel. This ViewSet is nested in BlockViewSet."""
+    queryset = Kernel.objects.all()
+    serializer_class = KernelSerializer
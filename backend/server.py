@@ -0,0 +1,49 @@
+"""
+Daphne server with optional permessage-deflate compression of websocket
+messages. Run it like daphne, eg.
+'python -m backend.server -b 0.0.0.0 -p 8001 backend.asgi:application'.
+"""
+from autobahn.websocket.compress import (
+    PerMessageDeflateOffer,
+    PerMessageDeflateOfferAccept,
+)
+from daphne.cli import CommandLineInterface
+from daphne.server import Server
+from django.conf import settings
+
+
+def accept_permessage_deflate(offers):
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(
+                offer,
+                False,
+                0,
+                None,
+                settings.WS_PERMESSAGE_DEFLATE_WINDOW_BITS,
+                settings.WS_PERMESSAGE_DEFLATE_MEM_LEVEL,
+            )
+    return None
+
+
+class CompressingServer(Server):
+    # daphne creates the websocket factory in run() and doesn't expose its
+    # options, so compression is enabled when the factory is assigned
+    @property
+    def ws_factory(self):
+        return self._ws_factory
+
+    @ws_factory.setter
+    def ws_factory(self, factory):
+        if settings.WS_PERMESSAGE_DEFLATE:
+            factory.setProtocolOptions(
+                perMessageCompressionAccept=accept_permessage_deflate)
+        self._ws_factory = factory
+
+
+class CompressingCommandLineInterface(CommandLineInterface):
+    server_class = CompressingServer
+
+
+if __name__ == '__main__':
+    CompressingCommandLineInterface.entrypoint()
@@ -96,6 +96,10 @@ CHANNEL_LAYERS = {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             'hosts': [('redis', 6379)],
+            # messages to slow clients are dropped instead of piling up, the
+            # next coalesced broadcast carries the latest state anyway
+            'capacity': 100,
+            'expiry': 10,
         },
     },
 }
@@ -254,7 +258,63 @@ DRAMATIQ_TASKS_DATABASE = "default"
 
 MIN_REORG_LEN = 2
 
+# minimal length of hash, excess or commitment prefix used in search
+MIN_SEARCH_PREFIX_LEN = 6
+
+# number of blocks fetched from the db at once when exporting blocks
+EXPORT_CHUNK_SIZE = 1000
+
+# maximal number of points returned by the timeseries endpoint, when no
+# resolution is given the finest one which fits is used
+TIMESERIES_MAX_POINTS = 1000
+
+# seconds for which clients and proxies may cache timeseries responses
+TIMESERIES_CACHE_MAX_AGE = 60
+
+# coinbase reward of every block (including genesis) in nanogrin
+BLOCK_REWARD = 60 * 10**9
+
+# number of blocks over which block hashrate is estimated, 60 blocks is about
+# one hour
+HASHRATE_WINDOW = 60
+
 GET_PRICE_FN = 'backend.api.helpers.default_fetch_price_fn'
 
 REDIS_PRICE_KEY = 'price_data'
 
+# redis sorted set of heights of accepted blocks which are waiting to be
+# stored, formatted with blockchain's slug
+ACCEPTED_BLOCKS_REDIS_KEY = 'accepted_blocks__{}'
+# redis lock held by whoever writes blocks of a blockchain (bootstrap,
+# accepted blocks ingestion, linkage repair), formatted with blockchain's slug
+INGESTION_LOCK_KEY = 'ingestion_lock__{}'
+# seconds after which the ingestion lock expires if its holder dies, it's
+# renewed after each stored block or batch
+INGESTION_LOCK_TIMEOUT = 600
+# max number of queued accepted blocks which are stored together, they're
+# fetched in ranges and clients are notified once per batch
+ACCEPTED_BLOCKS_BATCH_SIZE = 1000
+# max number of blocks sent to clients in a single websocket message
+WS_NEW_BLOCKS_LIMIT = 50
+
+# milliseconds during which websocket events of a blockchain are coalesced,
+# new blocks are sent in one message and only the latest progress is sent
+WS_BROADCAST_INTERVAL = 1000
+# redis keys of events waiting to be broadcasted, formatted with blockchain's
+# slug, and of the flag which is set while a broadcast is scheduled
+WS_PENDING_BROADCAST_KEY = 'ws_pending_broadcast__{}'
+WS_PENDING_BLOCKS_KEY = 'ws_pending_blocks__{}'
+WS_BROADCAST_SCHEDULED_KEY = 'ws_broadcast_scheduled__{}'
+# permessage-deflate compression of websocket messages, it's only used when
+# the websocket server is started through backend.server. Messages are
+# compressed for each connection so it trades CPU for bandwidth.
+WS_PERMESSAGE_DEFLATE = env.bool('WS_PERMESSAGE_DEFLATE', default=False)
+# zlib window size (8-15) and memory level (1-9), None uses the defaults
+WS_PERMESSAGE_DEFLATE_WINDOW_BITS = None
+WS_PERMESSAGE_DEFLATE_MEM_LEVEL = None
+# redis key of the pre-rendered snapshot which is sent to websocket clients
+# when they subscribe to a blockchain, formatted with blockchain's slug
+WS_SNAPSHOT_KEY = 'ws_snapshot__{}'
+# number of latest main chain blocks in the snapshot, it matches the default
+# page size of the block list
+WS_SNAPSHOT_NR_BLOCKS = 10
@@ -11,6 +11,9 @@ from .api.views import (
     index_view,
     BlockchainViewSet,
     BlockViewSet,
+    BlockInputViewSet,
+    BlockOutputViewSet,
+    BlockKernelViewSet,
     NodeViewSet,
     NodeGroupViewSet,
 )
@@ -31,6 +34,27 @@ block_router.register(
     basename='blockchain-blocks'
 )
 
+block_element_router = routers.NestedSimpleRouter(
+    block_router,
+    r'blocks',
+    lookup='block')
+
+block_element_router.register(
+    r'inputs',
+    BlockInputViewSet,
+    basename='block-inputs'
+)
+block_element_router.register(
+    r'outputs',
+    BlockOutputViewSet,
+    basename='block-outputs'
+)
+block_element_router.register(
+    r'kernels',
+    BlockKernelViewSet,
+    basename='block-kernels'
+)
+
 
 urlpatterns = [
     path('', index_view, name='index'),
@@ -42,5 +66,6 @@ urlpatterns = [
     # router
     path('api/', include(router.urls)),
     path('api/', include(block_router.urls)),
+    path('api/', include(block_element_router.urls)),
 ]
 
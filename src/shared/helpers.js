@@ -79,3 +79,12 @@ export function getDateRepr(date) {
   const splitted = date.toUTCString().split(' ')
   return `${splitted[2]} ${splitted[1]}`
 }
+
+
+// blocks shown in the block list keep their timestamp as Date so that all
+// ways of loading them are displayed and sorted the same
+export function parseBlockTimestamps(blocks) {
+  for (const block of blocks) {
+    block.timestamp = new Date(block.timestamp)
+  }
+}
@@ -1,7 +1,7 @@
 import Vue from 'vue';
 import blockchainService from '../../services/blockchain'
 import blockService from '../../services/block'
-import { routeTo } from '@/shared/helpers'
+import { parseBlockTimestamps, routeTo } from '@/shared/helpers'
 import { get as _get } from 'lodash';
 
 const state = {
@@ -112,9 +112,7 @@ const actions = {
     return blockService.fetchBlocks(state.selectedBlockchain.slug, state.page, state.itemsPerPage)
       .then(blocks => {
         commit('setLatestSearch', null)
-        for (const block of blocks.results) {
-          block.timestamp = new Date(block.timestamp)
-        }
+        parseBlockTimestamps(blocks.results)
         commit('setBlocks', blocks.results)
         commit('setTotalBlocks', blocks.count)
         if (state.page === 1) {
@@ -149,9 +147,7 @@ const actions = {
           // got blocks where reorgs started or those that match the search
           // formula, pass that to the blocks component set timestamp as you do
           // in the store getBlocks
-          for (const block of responseData.results) {
-            block.timestamp = (new Date(block.timestamp)).toUTCString()
-          }
+          parseBlockTimestamps(responseData.results)
           commit('setBlocks', responseData.results)
           commit('setTotalBlocks', responseData.count)
           routeTo('blocks', { blockchain: state.selectedBlockchain.slug })